@@ -1,7 +1,17 @@
+from metrics import REGISTRY
+
+
 class Arbitrator:
 
     # Denne klassen velger en winning-behavior som returneres.
 
+    def __init__(self):
+        self.winner = None                      # navnet på siste winning-behavior
+
+    def set_winner(self, name):
+        self.winner = name
+        REGISTRY.counter('arbitrator_wins_total', behavior=name).inc()
+
     def choose_action(self, behaviors):
         winning_behavior = None
         max_weight = -1
@@ -11,6 +21,7 @@ class Arbitrator:
             # Hvis behavioren skal stoppe returnerer vi umiddelbart denne
             if behavior.halt_request:
                 print(behavior.name, " will be recommended")
+                self.set_winner(behavior.name)
                 return behavior.motor_recommendations
 
             # Hvis den ikke skal stoppe velger behavior med høyest weight
@@ -21,6 +32,8 @@ class Arbitrator:
         # Kjører bare fremover hvis ingen behavior ble funnet,
         if winning_behavior is None:
             print("Found no behavior, driving forwards")
+            self.set_winner("none")
             return ["f"]
         print(winning_behavior.name, " will be recommended")
+        self.set_winner(winning_behavior.name)
         return winning_behavior.motor_recommendations
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bbcon import Bbcon
+from motob import Motob
+from metrics import REGISTRY
+
+
+class AsyncMotob(Motob):
+
+    # Kjører de samme bevegelsene som Motob, men venter med asyncio.sleep i stedet for Motors.persist
+    async def update_async(self, motor_recommendation):
+        self.values = motor_recommendation
+        print("Motor Recommendation = ", self.values[0])
+        REGISTRY.counter('motor_commands_total', command=self.values[0]).inc()
+        moves = self.get_moves()
+        self.set_speed(moves)
+        for speeds, duration, turn in moves:
+            if turn:
+                await self.closed_loop_turn_async(speeds, duration, turn)
+                continue
+            self.motor.set_value(speeds)
+            await asyncio.sleep(duration)
+            self.motor.stop()
+
+        # 'p' tar bilde, som er treg I/O
+        if self.values[0] == 'p':
+            await self.camera.sensor.update_async()
+            self.camera.value = self.camera.sensor.get_value()
+        else:
+            self.finish_moves()
+
+    # Som Motob.closed_loop_turn, men sensoren leses i bbcon sin sensortråd og ventingen gir loopen fri
+    async def closed_loop_turn_async(self, speeds, duration, turn):
+        loop = asyncio.get_event_loop()
+        executor = self.bbcon.sensor_executor
+        start = time.time()
+        self.motor.set_value(speeds)
+        reached = await loop.run_in_executor(executor, turn.done)
+        while not reached and time.time() - start < duration:
+            await asyncio.sleep(self.turn_poll)
+            reached = await loop.run_in_executor(executor, turn.done)
+        self.motor.stop()
+        self.learn_turn_rate(speeds, turn, time.time() - start, reached)
+
+
+class AsyncBbcon(Bbcon):
+
+    # Bbcon hvor sensorlesing, motorbevegelser og timestep-timeren er awaitables, slik at andre tasks (telemetri,
+    # knapp osv.) kan dele loopen. Sonaren og reflektanssensorene måler pulsbredder med busy-wait i Python, og blir
+    # feil hvis en annen tråd har GIL-en imens. Behaviors oppdateres derfor én om gangen i én sensortråd. Bare
+    # kamerabildene tas samtidig, som raspistill-subprosesser fra loopen.
+
+    motob_class = AsyncMotob
+
+    def __init__(self, loop=None):
+        super(AsyncBbcon, self).__init__()
+        self.loop = loop if loop else asyncio.get_event_loop()
+        self.tasks = []                         # ekstra tasks som deler loopen med kontroll-loopen
+        self.sensor_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sensors")
+
+    # Legger til en coroutine som skal kjøre ved siden av kontroll-loopen
+    def add_task(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    # Som Bbcon.update_behaviors: de kritiske først, så de andre som rekker det
+    async def update_behaviors(self):
+        await self.update_group(self.plan_critical())
+        await self.update_group(self.plan_optional())
+
+        # Arbitrator forventer samme rekkefølge som i den synkrone loopen
+        self.active_behaviors.sort(key=self.behaviors.index)
+
+    # Behaviors uten kamera oppdateres mens kamerabildene tas, deretter de som bruker bildene
+    async def update_group(self, planned):
+        if not planned:
+            return
+        cameras = {behavior: behavior.prefetch_sensobs() for behavior in planned}
+        frames = self.loop.create_task(self.prefetch_frames(cameras))
+        await self.loop.run_in_executor(self.sensor_executor, self.update_serially,
+                                        [b for b in planned if not cameras[b]])
+        await frames
+        await self.loop.run_in_executor(self.sensor_executor, self.update_serially,
+                                        [b for b in planned if cameras[b]])
+
+    # Kameraene tas etter hverandre, to raspistill samtidig slåss om kameraet
+    async def prefetch_frames(self, cameras):
+        done = set()
+        for sensobs in cameras.values():
+            for sensob in sensobs:
+                if sensob not in done:
+                    done.add(sensob)
+                    await sensob.prefetch()
+
+    def update_serially(self, behaviors):
+        for behavior in behaviors:
+            self.timed_update(behavior)
+
+    async def run_one_timestep_async(self):
+        start = self.timestep_start = time.time()
+
+        await self.update_behaviors()
+
+        print("Active behaviors", self.active_behaviors)
+        motor_recoms = self.arbitrator.choose_action(self.active_behaviors)
+
+        await self.motobs.update_async(motor_recoms)
+
+        self.request_photo()
+
+        # vent resten av timestepet, men ikke lenger enn timestep_length totalt
+        remaining = self.timestep_length - (time.time() - start)
+        await asyncio.sleep(max(remaining, 0))
+
+        self.end_timestep()
+
+    async def run(self, timesteps=None):
+        try:
+            while timesteps is None or self.num_timesteps < timesteps:
+                await self.run_one_timestep_async()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            self.sensor_executor.shutdown(wait=False)
@@ -0,0 +1,100 @@
+# Converts a whole directory tree of images with imager2.reformat, spread over a pool of processes.
+#
+#   python batch_convert.py captures/ converted/ --ext jpeg --scale 0.5 --workers 4
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from imager2 import reformat
+
+IMAGE_EXTENSIONS = ('.png', '.gif', '.jpeg', '.jpg', '.bmp', '.ppm')
+
+
+# Finner alle bildefiler under in_dir og hvilken fil de skal konverteres til under out_dir
+def find_jobs(in_dir, out_dir, out_ext):
+    for root, dirs, files in os.walk(in_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            in_fid = os.path.join(root, name)
+            rel = os.path.relpath(in_fid, in_dir)
+            out_fid = os.path.join(out_dir, os.path.splitext(rel)[0] + '.' + out_ext)
+            yield in_fid, out_fid
+
+
+# Filen er oppdatert hvis den konverterte filen finnes og er nyere enn originalen
+def up_to_date(in_fid, out_fid):
+    return os.path.exists(out_fid) and os.path.getmtime(out_fid) >= os.path.getmtime(in_fid)
+
+
+def convert(in_fid, out_fid, out_ext, scale):
+    os.makedirs(os.path.dirname(out_fid) or '.', exist_ok=True)
+    reformat(in_fid, out_ext, scale, scale, out_fid=out_fid)
+    return in_fid
+
+
+# Konverterer alle bildene. Maks max_in_flight bilder er sendt til prosessene om gangen, slik at minnebruken
+# ikke vokser med størrelsen på katalogen.
+def batch_convert(in_dir, out_dir, out_ext='jpeg', scale=1.0, workers=None, max_in_flight=None, force=False):
+    workers = workers if workers else os.cpu_count() or 1
+    max_in_flight = max_in_flight if max_in_flight else 2 * workers
+    converted = 0
+    skipped = 0
+    failed = []
+    start = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+
+        def collect(done):
+            nonlocal converted
+            for future in done:
+                try:
+                    future.result()
+                    converted += 1
+                except Exception as e:
+                    failed.append((future.in_fid, e))
+
+        for in_fid, out_fid in find_jobs(in_dir, out_dir, out_ext):
+            if not force and up_to_date(in_fid, out_fid):
+                skipped += 1
+                continue
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = pool.submit(convert, in_fid, out_fid, out_ext, scale)
+            future.in_fid = in_fid
+            pending.add(future)
+
+        collect(wait(pending)[0])
+
+    elapsed = time.time() - start
+    return {'converted': converted, 'skipped': skipped, 'failed': failed, 'seconds': elapsed,
+            'images_per_second': converted / elapsed if elapsed > 0 else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a directory tree of images with imager2")
+    parser.add_argument('in_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--ext', default='jpeg', help="output format, e.g. jpeg, png, gif")
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-in-flight', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help="convert files that are already up to date")
+    args = parser.parse_args()
+
+    result = batch_convert(args.in_dir, args.out_dir, args.ext, args.scale, args.workers, args.max_in_flight,
+                           args.force)
+    for in_fid, e in result['failed']:
+        print("Failed:", in_fid, e)
+    print("Converted %d, skipped %d, failed %d in %.2f s (%.1f images/s)"
+          % (result['converted'], result['skipped'], len(result['failed']), result['seconds'],
+             result['images_per_second']))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,43 @@
+import time
 from arbitrator import Arbitrator
 from time import sleep
+from sensob import CHEAP, MODERATE, EXPENSIVE
+from metrics import REGISTRY
 from motob import Motob
 from behavior import Photo
 
 class Bbcon:
 
+    motob_class = Motob                         # underklasser kan bytte ut motob-typen
+
     def __init__(self):
         self.behaviors = []                     # behavior-listen, med både inaktive og aktive behaviors
         self.active_behaviors = []              # liste med aktive behaviors
         self.sensobs = []                       # liste med sensor-objekter
-        self.motobs = Motob(self)               # list med motor-objekter
+        self.motobs = self.motob_class(self)    # list med motor-objekter
         self.arbitrator = Arbitrator()          # arbitrator-objektet, velger winning-behavior
         self.num_timesteps = 0                  # antall timesteps som er kjørt
         self.can_take_photo = False
-
+        self.photo_requested = 0.0              # når roboten stoppet for å ta bilde, se request_photo
+        self.timestep_length = 0.25             # sekunder motorene får per timestep
+
+        # Load shedding: kritiske behaviors kjøres først. Ikke-kritiske behaviors (kamera, bildelagring) kjøres
+        # bare hvis de rekker å bli ferdige før sense_budget er brukt opp, ellers hoppes de over dette timestepet.
+        self.load_shedding = False
+        self.sense_budget = 0.6                 # sekunder behaviors får per timestep. Må dekke et sonar-ping,
+                                                # som alene venter 0.3 s i Ultrasonic.send_activation_pulse
+        self.max_deferrals = 4                  # en behavior hoppes ikke over flere ganger på rad enn dette
+        self.cost_estimates = {CHEAP: 0.005, MODERATE: 0.05, EXPENSIVE: 0.5}
+        self.behavior_costs = {}                # målt tid per behavior, glidende snitt
+        self.cost_decay = 0.7                   # en behavior som hoppes over får anslaget ganget med dette, siden
+                                                # målingen blir gammel (f.eks. Photo som bare er dyr når den tar bilde)
+        self.deferrals = {}                     # hvor mange timesteps på rad hver behavior er hoppet over
+        self.shed_counts = {}                   # hvor mange ganger hver behavior eller jobb er hoppet over
+        self.timestep_start = time.time()
+
+        self.metrics_file = None                # skriv metrics i Prometheus-format til denne filen
+        self.metrics_every = 20                 # ... hvert metrics_every timestep
+        self.telemetry = None                   # TelemetryPublisher som får en post hvert timestep
 
     # Legger til behavior i listen
     def add_behavior(self, behavior):
@@ -35,17 +59,87 @@ class Bbcon:
         if behavior in self.active_behaviors:
             self.active_behaviors.remove(behavior)
 
+    # Kalles etter motobs. Har roboten stoppet for å ta bilde, kan Photo ta det, og tidspunktet huskes slik at
+    # bilder som ble tatt før roboten stoppet ikke brukes.
+    def request_photo(self):
+        if self.motobs.photograph and not self.can_take_photo:
+            self.can_take_photo = True
+            self.photo_requested = time.time()
+
     # Resetter hvis foto er tatt
     def photo_taken(self):
         self.can_take_photo = False
         self.motobs.photograph = False
 
+    # Tid igjen av sense_budget dette timestepet
+    def remaining_budget(self):
+        return self.sense_budget - (time.time() - self.timestep_start)
+
+    # Om det er tid til noe av denne kostklassen. Alltid sant uten load shedding.
+    def can_afford(self, cost):
+        return not self.load_shedding or self.cost_estimates[cost] <= self.remaining_budget()
+
+    def record_shed(self, name):
+        self.shed_counts[name] = self.shed_counts.get(name, 0) + 1
+        REGISTRY.counter('bbcon_shed_total', work=name).inc()
+
+    # Hvor lang tid behavioren antas å ta: målt tid hvis vi har den, ellers anslaget for kostklassen
+    def estimate(self, behavior):
+        return self.behavior_costs.get(behavior, self.cost_estimates[behavior.get_cost()])
+
+    # Behaviors som alltid kjøres: alle uten load shedding, ellers de kritiske
+    def plan_critical(self):
+        if not self.load_shedding:
+            return list(self.behaviors)
+        return [b for b in self.behaviors if b.is_critical()]
+
+    # Velger hvilke andre behaviors som skal kjøres, etter at de kritiske er ferdige. Så lenge anslått tid får
+    # plass i det som er igjen av budsjettet kjøres de, de som har ventet lengst først.
+    def plan_optional(self):
+        if not self.load_shedding:
+            return []
+
+        left = self.remaining_budget()
+        planned = []
+        optional = [b for b in self.behaviors if not b.is_critical()]
+        optional.sort(key=lambda b: -self.deferrals.get(b, 0))
+        for behavior in optional:
+            cost = self.estimate(behavior)
+            if cost <= left or self.deferrals.get(behavior, 0) >= self.max_deferrals:
+                left -= cost
+                planned.append(behavior)
+                self.deferrals[behavior] = 0
+            else:
+                self.deferrals[behavior] = self.deferrals.get(behavior, 0) + 1
+                self.behavior_costs[behavior] = cost * self.cost_decay
+                self.record_shed(behavior.name)
+
+        planned.sort(key=self.behaviors.index)
+        return planned
+
+    def update_behaviors(self):
+        for behavior in self.plan_critical():
+            self.timed_update(behavior)
+        for behavior in self.plan_optional():
+            self.timed_update(behavior)
+
+        # Arbitrator forventer behaviors i samme rekkefølge som de ble lagt til
+        self.active_behaviors.sort(key=self.behaviors.index)
+
+    # Oppdaterer behavioren og måler hvor lang tid det tok
+    def timed_update(self, behavior):
+        start = time.time()
+        behavior.update()
+        spent = time.time() - start
+        old = self.behavior_costs.get(behavior)
+        self.behavior_costs[behavior] = spent if old is None else 0.8 * old + 0.2 * spent
+
     # "loopen" til klassen
     def run_one_timestep(self):
+        self.timestep_start = time.time()
 
         # Oppdaterer behaviors
-        for behaviour in self.behaviors:
-            behaviour.update()
+        self.update_behaviors()
 
         # Henter ut motor-recommendations
         print("Active behaviors", self.active_behaviors)
@@ -54,11 +148,23 @@ class Bbcon:
         # Oppdaterer motobs
         self.motobs.update(motor_recoms)
 
-        if self.motobs.photograph:
-            self.can_take_photo = True
+        self.request_photo()
 
         # vent slik at motorene kan gjøre tingen sin
-        sleep(0.25)
+        sleep(self.timestep_length)
+
+        self.end_timestep()
+
+    # Rydder opp etter et timestep
+    def end_timestep(self):
+
+        # Tiden timestepet tok, og hvem som hadde kontrollen
+        duration = time.time() - self.timestep_start
+        REGISTRY.histogram('bbcon_tick_seconds').observe(duration)
+        if self.arbitrator.winner:
+            REGISTRY.counter('behavior_control_seconds_total', behavior=self.arbitrator.winner).inc(duration)
+        if self.telemetry:
+            self.telemetry.publish(self, duration)
 
         # Reset sensorverdiene
         for sensor in self.sensobs:
@@ -67,3 +173,6 @@ class Bbcon:
         self.active_behaviors=[]
 
         self.num_timesteps += 1
+
+        if self.metrics_file and self.num_timesteps % self.metrics_every == 0:
+            REGISTRY.export(self.metrics_file)
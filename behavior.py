@@ -1,6 +1,6 @@
 from abc import abstractclassmethod
-from sensob import *
-from imager2 import Imager
+from sensob import ReflectanceSensob, UltrasonicSensob, IRProximitySensob, CameraSensob, CameraLineSensob
+from sensob import CHEAP, EXPENSIVE
 
 
 class Behavior:
@@ -16,6 +16,25 @@ class Behavior:
         self.match_degree = 0                                   # Enten 0 eller 1. Brukes i samsvar med weight og priority.
         self.weight = self.match_degree * self.priority         # vektingen til behavioren når den benyttes av Arbitrator.
         self.name = ""
+        self.cost = None                                        # kostklasse, None betyr den dyreste av sensobsene
+        self.critical = None                                    # None betyr kritisk hvis en av sensobsene er det
+
+    # Kostklassen Bbcon bruker ved load shedding
+    def get_cost(self):
+        if self.cost is not None:
+            return self.cost
+        return max([sensob.cost for sensob in self.sensobs] + [CHEAP])
+
+    # Kritiske behaviors kjøres alltid, også når timestepet er i ferd med å bli for langt
+    def is_critical(self):
+        if self.critical is not None:
+            return self.critical
+        return any(sensob.critical for sensob in self.sensobs)
+
+    # Sensobs med treg I/O (kamera) som update() kommer til å lese dette timestepet. AsyncBbcon tar bildene
+    # på forhånd med prefetch(), mens de tidskritiske GPIO-sensorene leses.
+    def prefetch_sensobs(self):
+        return []
 
     # Tester om behavioren skal deaktiveres
     def consider_deactivation(self):
@@ -36,12 +55,21 @@ class Behavior:
 # stopper roboten hvis sensoren detekterer et objekt
 class Obstruction(Behavior):
 
-    def __init__(self, bbcon):
+    def __init__(self, bbcon, use_ir=False, u_sensob=None, adaptive_sonar=False):
         super(Obstruction,self).__init__(bbcon)
         self.name = "Obstruction"
-        self.u_sensob = UltrasonicSensob()
+        # Uten adaptive_sonar eller use_ir pinges sonaren hvert tick, som før
+        self.u_sensob = u_sensob if u_sensob else UltrasonicSensob(adaptive=adaptive_sonar or use_ir)
         self.sensobs.append(self.u_sensob)
 
+        # Med use_ir leses IR-sensoren hvert tick, og sonaren pinges bare når IR ser noe nært,
+        # eller når sonaren uansett skal bekrefte avstanden (u_sensob.max_interval)
+        self.ir_sensob = None
+        if use_ir:
+            self.ir_sensob = IRProximitySensob()
+            self.sensobs.append(self.ir_sensob)
+        self.ir_gated_pings = 0
+
     # aktiver behavior hvis sensoren ser noe nærmere enn 10 centimeter
     def consider_activation(self):
         val=self.u_sensob.get_value()
@@ -62,8 +90,14 @@ class Obstruction(Behavior):
 
     def update(self):
 
-        for sensor in self.sensobs:
-            sensor.update()
+        # Sonaren pinger oftere jo fortere vi kjører
+        self.u_sensob.set_speed(self.bbcon.motobs.speed)
+
+        if self.ir_sensob:
+            self.update_tiered()
+        else:
+            for sensor in self.sensobs:
+                sensor.update()
 
         if self.active_flag:
             self.consider_deactivation()
@@ -78,6 +112,15 @@ class Obstruction(Behavior):
         self.sense_and_act()
         self.weight = self.priority * self.match_degree
 
+    # IR først, sonar bare ved behov
+    def update_tiered(self):
+        self.ir_sensob.update()
+        if self.ir_sensob.something_near() or self.active_flag:
+            self.ir_gated_pings += 1
+            self.u_sensob.update(force=True)
+        else:
+            self.u_sensob.update()
+
     def sense_and_act(self):
         self.motor_recommendations = ["s"]
         self.priority = 1
@@ -116,10 +159,10 @@ class DriveForward(Behavior):
 
 class FollowLine(Behavior):
 
-    def __init__(self, bbcon):
+    def __init__(self, bbcon, r_sensob=None):
         super(FollowLine, self).__init__(bbcon)
         self.name = "FollowLine"
-        self.r_sensob = ReflectanceSensob()
+        self.r_sensob = r_sensob if r_sensob else ReflectanceSensob()
         self.sensobs.append(self.r_sensob)
         self.treshold = 0.3
 
@@ -172,12 +215,72 @@ class FollowLine(Behavior):
         self.priority = 0.5
 
 
-class Photo(Behavior):
+# Følger linjen med kameraet. Ser linjen lenger fremme enn reflektanssensorene, og kan derfor kjøre fort på
+# rettstrekninger og bremse før svinger.
+class CameraFollowLine(Behavior):
+
     def __init__(self, bbcon):
+        super(CameraFollowLine, self).__init__(bbcon)
+        self.name = "CameraFollowLine"
+        self.l_sensob = CameraLineSensob()
+        self.sensobs.append(self.l_sensob)
+        self.max_speed = 0.8                    # fart på rettstrekninger
+        self.min_speed = 0.3                    # fart i krappe svinger
+        self.steering = 0.4                     # hvor mye offset styrer hjulene
+
+    def prefetch_sensobs(self):
+        return [self.l_sensob]
+
+    def consider_activation(self):
+        if self.l_sensob.get_value() is not None:
+            self.bbcon.activate_behavior(self)
+            self.active_flag = True
+        else:
+            self.bbcon.deactivate_behavior(self)
+            self.active_flag = False
+
+    def consider_deactivation(self):
+        self.consider_activation()
+
+    def update(self):
+        self.l_sensob.update()
+        self.consider_activation()
+
+        if not self.active_flag:
+            self.weight = 0
+            return
+
+        self.sense_and_act()
+        self.weight = self.priority * self.match_degree
+
+    def sense_and_act(self):
+        offset, curvature = self.l_sensob.get_value()
+
+        # Bremser mer jo mer linjen svinger fremover og jo lenger unna midten vi er
+        bend = min(abs(curvature) + abs(offset), 1)
+        speed = self.max_speed - (self.max_speed - self.min_speed) * bend
+        turn = self.steering * (offset + curvature / 2)
+        left = max(min(speed + turn, 1), -1)
+        right = max(min(speed - turn, 1), -1)
+
+        self.motor_recommendations = ['d', left, right]
+        self.match_degree = 0.8
+        self.priority = 0.6
+
+
+class Photo(Behavior):
+    def __init__(self, bbcon, c_sensob=None, frame_sink=None):
         super(Photo, self).__init__(bbcon)
         self.name = "Photo"
-        self.c_sensob = CameraSensob()
+        self.c_sensob = c_sensob if c_sensob else CameraSensob()   # PerceptionSensob kan brukes i stedet
         self.sensobs.append(self.c_sensob)
+        self.frame_sink = frame_sink            # FrameSink som lagrer bildene i bakgrunnen, ellers lagres de her
+
+    def prefetch_sensobs(self):
+        # PerceptionSensob tar bildene i sin egen prosess
+        if self.bbcon.can_take_photo and hasattr(self.c_sensob, 'prefetch'):
+            return [self.c_sensob]
+        return []
 
     def consider_activation(self):
 
@@ -207,23 +310,27 @@ class Photo(Behavior):
 
         if self.bbcon.can_take_photo:
             print("Taking photo!")
+            if hasattr(self.c_sensob, 'not_before'):
+                # PerceptionSensob tar bilder hele tiden, så vi må vente på et som ble tatt etter at roboten stoppet
+                self.c_sensob.not_before = self.bbcon.photo_requested
             image_obj = self.c_sensob.update()
-            img = Imager(image=image_obj)
-            img.dump_image('/')
-
+            if image_obj is None:
+                return
             self.match_degree = 0.9
 
-            triple2 = [0] * 3
-            for x in range(img.xmax):
-                for y in range(img.ymax):
-                    t = img.get_pixel(x, y)
-                    for i in range(len(triple2)):
-                        triple2[i] += t[i]
+            color = self.c_sensob.get_dominant_color()
+            print("Dominant color", color)
 
-            print("RGB", triple2)
-            print(triple2[0] > triple2[1] and triple2[0] > triple2[2])
+            if self.frame_sink:
+                # Sinken eier bildet til det er skrevet, og gir det tilbake til en eventuell FramePool
+                self.frame_sink.put(self.c_sensob.take())
+            elif self.bbcon.can_afford(EXPENSIVE):
+                from imager2 import Imager
+                Imager(image=image_obj).dump_image('/')
+            else:
+                self.bbcon.record_shed("Photo.save")
 
-            if triple2[0] > triple2[1] and triple2[0] > triple2[2]:
+            if color == 'red':
                 self.motor_recommendations = ['t']
 
             else:
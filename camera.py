@@ -1,30 +1,81 @@
+import asyncio
+import fcntl
+import itertools
 import os
+import tempfile
 from PIL import Image
 
+# Only one raspistill can use the camera at a time, also across processes (the perception worker has its own
+# Camera), so every capture holds an exclusive lock on this file
+CAPTURE_LOCK = os.path.join(tempfile.gettempdir(), 'zumo_camera.lock')
+
+
+def acquire_capture_lock():
+    lock = open(CAPTURE_LOCK, 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def release_capture_lock(lock):
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
 
 class Camera():
 
+    _instances = itertools.count()
+
     def __init__(self, img_width=128, img_height=96, img_rot=0):
         self.value = None
         self.img_width = img_width
         self.img_height = img_height
         self.img_rot = img_rot
+        # Each camera writes its pictures to its own file, so two cameras never read each other's picture
+        self.out_file = os.path.join(tempfile.gettempdir(),
+                                     'camera_%d_%d.png' % (os.getpid(), next(Camera._instances)))
 
     def get_value(self):  return self.value
 
-    def update(self):
-        self.sensor_get_value()
+    # If out is given, the picture is written into that image (e.g. a frame borrowed from a FramePool) instead of
+    # a new one.  out must have the camera's size and be RGB.
+    def update(self, out=None):
+        self.sensor_get_value(out)
         return self.value
 
     def reset(self):
         self.value = None
 
-    def sensor_get_value(self):
-        # This is a OS call that takes a image and makes it accessible to PIL operations in the same directory
-        os.system('raspistill -t 1 -o image.png -w "' + str(self.img_width) + '" -h "' + str(self.img_height) + '" -rot "' + str(self.img_rot) + '"')
+    def sensor_get_value(self, out=None):
+        # This is a OS call that takes a image and makes it accessible to PIL operations in out_file
+        lock = acquire_capture_lock()
+        try:
+            os.system('raspistill -t 1 -o "' + self.out_file + '" -w "' + str(self.img_width) + '" -h "' + str(self.img_height) + '" -rot "' + str(self.img_rot) + '"')
+        finally:
+            release_capture_lock(lock)
         # Open the image just taken by raspicam
         # Stores the RGB array in the value field
-        self.value = Image.open('image.png').convert('RGB')
+        self.value = self.read_image(self.out_file, out)
+
+    def read_image(self, fid, out=None):
+        image = Image.open(fid).convert('RGB')
+        if out is None:
+            return image
+        out.paste(image)
+        return out
+
+    # Same as update, but raspistill runs as an asyncio subprocess so the event loop can do other work meanwhile
+    # The capture lock is waited for in the executor, so a capture in another process does not block the loop.
+    async def update_async(self, out=None):
+        lock = await asyncio.get_event_loop().run_in_executor(None, acquire_capture_lock)
+        try:
+            proc = await asyncio.create_subprocess_exec('raspistill', '-t', '1', '-o', self.out_file,
+                                                        '-w', str(self.img_width), '-h', str(self.img_height),
+                                                        '-rot', str(self.img_rot))
+            await proc.wait()
+        finally:
+            release_capture_lock(lock)
+        self.value = self.read_image(self.out_file, out)
+        return self.value
 
 # Just testing the camera in python
 
@@ -0,0 +1,111 @@
+import importlib
+import threading
+import time
+
+# Enhetene (sensorer, motorer, kamera) lages først når de brukes, og deles mellom alle som ber om samme navn.
+# Da slipper FollowLine og DriveForward å lage og kalibrere hver sin ReflectanceSensors, og oppstarten blir rask.
+# warm_up() lager alle registrerte enheter og importerer tunge moduler i en bakgrunnstråd, f.eks. mens
+# ZumoButton.wait_for_press venter. report() skriver ut hva oppstarten kostet.
+
+HEAVY_MODULES = ['PIL.Image', 'numpy', 'imager2']
+
+startup_costs = []                              # (hva, sekunder), i den rekkefølgen det skjedde
+devices = {}                                    # navn -> LazyDevice
+warm_up_tasks = []                              # andre ting som skal gjøres i warm_up, f.eks. FramePool.preallocate
+
+
+class LazyDevice:
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def created(self):
+        return self.instance is not None
+
+    def get(self):
+        if self.instance is None:
+            with self.lock:
+                if self.instance is None:
+                    start = time.time()
+                    self.instance = self.factory()
+                    startup_costs.append(('init ' + self.name, time.time() - start))
+        return self.instance
+
+
+# Returnerer den delte LazyDevice-en med dette navnet, og registrerer den første gang
+def device(name, factory):
+    lazy = devices.get(name)
+    if lazy is None:
+        lazy = devices[name] = LazyDevice(name, factory)
+    return lazy
+
+
+def timed_import(name):
+    start = time.time()
+    module = importlib.import_module(name)
+    startup_costs.append(('import ' + name, time.time() - start))
+    return module
+
+
+def on_warm_up(task):
+    warm_up_tasks.append(task)
+
+
+# Importerer tunge moduler og lager alle registrerte enheter i en bakgrunnstråd. Returnerer tråden.
+def warm_up(modules=None):
+    def run():
+        for name in (modules if modules is not None else HEAVY_MODULES):
+            try:
+                timed_import(name)
+            except ImportError as e:
+                print("Could not import", name, e)
+        for lazy in list(devices.values()):
+            lazy.get()
+        for task in warm_up_tasks:
+            start = time.time()
+            task()
+            startup_costs.append((getattr(task, '__qualname__', str(task)), time.time() - start))
+
+    thread = threading.Thread(target=run, name="warm_up", daemon=True)
+    thread.start()
+    return thread
+
+
+def report():
+    print("Startup costs:")
+    for what, seconds in startup_costs:
+        print("  %-40s %8.1f ms" % (what, seconds * 1000))
+    print("  %-40s %8.1f ms" % ("total", sum(s for _, s in startup_costs) * 1000))
+
+
+# Fabrikkene importerer maskinvaremodulene selv, slik at ingenting av dette lastes før det trengs
+
+def reflectance_sensors():
+    from reflectance_sensors import ReflectanceSensors
+    return ReflectanceSensors()
+
+
+def ultrasonic():
+    from ultrasonic import Ultrasonic
+    return Ultrasonic()
+
+
+def ir_proximity():
+    from irproximity_sensor import IRProximitySensor
+    return IRProximitySensor()
+
+
+# Kamera med gitt oppløsning. Returnerer en fabrikk, siden kameraet har argumenter.
+def camera(img_width=128, img_height=96, img_rot=0):
+    def make():
+        from camera import Camera
+        return Camera(img_width, img_height, img_rot)
+    return make
+
+
+def motors():
+    from motors import Motors
+    return Motors()
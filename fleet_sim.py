@@ -0,0 +1,271 @@
+# Simulerer mange roboter i samme prosess, hver med sin egen Bbcon og FollowLine, Obstruction og Photo, på en
+# felles bane. Alle robotene sin tilstand ligger i numpy-arrays i Arena, så fysikken og sensormodellene regnes ut
+# for hele flåten på en gang. Robotene er hindringer for hverandre.
+#
+#   python fleet_sim.py --sizes 1,10,100,300 --ticks 50
+
+import argparse
+import contextlib
+import math
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from bbcon import Bbcon
+from behavior import FollowLine, Obstruction, Photo
+from motob import Motob
+from sensob import ReflectanceSensob, UltrasonicSensob, CameraSensob
+
+COLORS = np.array([(200, 30, 30), (30, 200, 30), (30, 30, 200)], dtype=np.uint8)    # rød, grønn, blå
+BACKGROUND = (120, 120, 120)
+
+
+class Arena:
+
+    # Rektangulær bane på width x height cm med en oval svart linje. Enheter er cm, sekunder og radianer.
+    # max_speed og wheelbase er valgt slik at Motob.NOMINAL_TURN_RATE stemmer: full fart snur ca. 360 grader/s.
+
+    def __init__(self, n_robots, width=400, height=300, max_speed=50.0, wheelbase=16.0, radius=5.0, seed=0):
+        self.n = n_robots
+        self.width = width
+        self.height = height
+        self.max_speed = max_speed
+        self.wheelbase = wheelbase
+        self.radius = radius
+        self.dt = 0.02                          # tidssteg i integrasjonen
+        self.time = 0.0                         # simulert tid, i sekunder
+        self.tick_pause = 0.25                  # det Bbcon.timestep_length sover på roboten, hvert steg
+        self.sonar_range = 300.0
+        self.sonar_cone = math.radians(15)
+        self.camera_range = 30.0
+        rng = np.random.RandomState(seed)
+
+        # Banen: oval linje, 3 cm bred
+        self.cx, self.cy = width / 2, height / 2
+        self.a, self.b = width / 2 - 50, height / 2 - 50
+        yy, xx = np.mgrid[0:height, 0:width]
+        r = np.hypot((xx - self.cx) / self.a, (yy - self.cy) / self.b)
+        self.line = np.abs(r - 1) * min(self.a, self.b) < 1.5
+
+        # Robotene starter jevnt fordelt langs linjen, med retning langs den
+        t = np.linspace(0, 2 * math.pi, n_robots, endpoint=False)
+        self.pos = np.stack([self.cx + self.a * np.cos(t), self.cy + self.b * np.sin(t)], axis=1)
+        self.heading = np.arctan2(self.b * np.cos(t), -self.a * np.sin(t))
+        self.color = rng.randint(len(COLORS), size=n_robots)
+
+        # Reflektanssensorene sitter 4 cm foran sentrum, fra venstre til høyre
+        self.sensor_forward = 4.0
+        self.sensor_lateral = np.array([4.0, 2.4, 0.8, -0.8, -2.4, -4.0])
+
+        self.moves = [[] for _ in range(n_robots)]  # motorkommandoer siden forrige steg, per robot
+        self.reflectance = np.ones((n_robots, 6))
+        self.sonar = np.full(n_robots, self.sonar_range)
+        self.seen = np.full(n_robots, -1)       # fargen (indeks i COLORS) på roboten kameraet ser, -1 = ingen
+        self.sense()
+
+    def add_move(self, index, speeds, duration):
+        self.moves[index].append((speeds[0], speeds[1], duration or 0))
+
+    # Kjører alle motorkommandoene som er gitt siden forrige steg, og oppdaterer sensorene. Den simulerte tiden
+    # går fram så lenge den lengste robotens bevegelser tok, pluss pausen på slutten av timestepet.
+    def step(self):
+        slots = max(len(m) for m in self.moves) if self.n else 0
+        for k in range(slots):
+            move = np.array([m[k] if k < len(m) else (0, 0, 0) for m in self.moves], dtype=float)
+            self.drive(move[:, 0], move[:, 1], move[:, 2])
+        longest = max((sum(d for _, _, d in m) for m in self.moves), default=0)
+        self.time += longest + self.tick_pause
+        self.moves = [[] for _ in range(self.n)]
+        self.sense()
+
+    def clock(self):
+        return self.time
+
+    # Differensialstyring for alle robotene samtidig, hver med sin egen varighet
+    def drive(self, left, right, duration):
+        v = (left + right) / 2 * self.max_speed
+        omega = (right - left) * self.max_speed / self.wheelbase
+        remaining = duration.copy()
+        while (remaining > 0).any():
+            dt = np.minimum(remaining, self.dt)
+            self.heading += omega * dt
+            self.pos[:, 0] += v * dt * np.cos(self.heading)
+            self.pos[:, 1] += v * dt * np.sin(self.heading)
+            remaining -= dt
+        np.clip(self.pos[:, 0], self.radius, self.width - self.radius, out=self.pos[:, 0])
+        np.clip(self.pos[:, 1], self.radius, self.height - self.radius, out=self.pos[:, 1])
+
+    def sense(self):
+        cos, sin = np.cos(self.heading), np.sin(self.heading)
+
+        # Reflektans: 0.1 over linjen, 0.9 ellers
+        sx = self.pos[:, 0:1] + cos[:, None] * self.sensor_forward - sin[:, None] * self.sensor_lateral
+        sy = self.pos[:, 1:2] + sin[:, None] * self.sensor_forward + cos[:, None] * self.sensor_lateral
+        ix = np.clip(sx.astype(int), 0, self.width - 1)
+        iy = np.clip(sy.astype(int), 0, self.height - 1)
+        self.reflectance = np.where(self.line[iy, ix], 0.1, 0.9)
+
+        # Sonar: nærmeste robot innenfor keglen foran, ellers veggen rett frem
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tx = np.where(cos > 0, (self.width - self.pos[:, 0]) / cos, np.where(cos < 0, -self.pos[:, 0] / cos, np.inf))
+            ty = np.where(sin > 0, (self.height - self.pos[:, 1]) / sin, np.where(sin < 0, -self.pos[:, 1] / sin, np.inf))
+        wall = np.minimum(tx, ty)
+
+        d = self.pos[None, :, :] - self.pos[:, None, :]        # [i, j] = vektor fra i til j
+        dist = np.hypot(d[..., 0], d[..., 1])
+        angle = np.arctan2(d[..., 1], d[..., 0]) - self.heading[:, None]
+        angle = (angle + math.pi) % (2 * math.pi) - math.pi
+        in_cone = (np.abs(angle) < self.sonar_cone) & (dist > 0)
+        robot_dist = np.where(in_cone, dist - self.radius, np.inf)
+        nearest = robot_dist.argmin(axis=1) if self.n else np.zeros(0, int)
+        robot = robot_dist[np.arange(self.n), nearest] if self.n else np.zeros(0)
+        self.sonar = np.clip(np.minimum(wall, robot), 0, self.sonar_range)
+
+        # Kamera: fargen på roboten foran hvis den er nær nok
+        self.seen = np.where(robot < self.camera_range, self.color[nearest], -1)
+
+    # Et lite bilde med fargen kameraet ser
+    def camera_image(self, index, size=(16, 12)):
+        seen = self.seen[index]
+        color = tuple(int(c) for c in COLORS[seen]) if seen >= 0 else BACKGROUND
+        return Image.new('RGB', size, color)
+
+
+# Simulerte enheter med samme grensesnitt som de ekte
+
+class SimReflectanceSensors:
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+        self.value = [-1.0] * 6
+
+    def update(self):
+        self.value = list(self.arena.reflectance[self.index])
+        return self.value
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = [-1.0] * 6
+
+
+class SimUltrasonic:
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+        self.value = None
+
+    def update(self):
+        self.value = float(self.arena.sonar[self.index])
+        return self.value
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class SimCamera:
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+        self.value = None
+
+    def update(self, out=None):
+        self.value = self.arena.camera_image(self.index)
+        return self.value
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class SimMotors:
+
+    # Bevegelsene legges i Arena og kjøres for hele flåten i Arena.step, i stedet for å sove her
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def set_value(self, val, dur=None):
+        self.arena.add_move(self.index, val, dur)
+
+    def stop(self):
+        return
+
+
+class DiscardFrames:
+
+    # FrameSink som ikke lagrer noe
+
+    def put(self, image):
+        return
+
+
+class SimMotob(Motob):
+
+    def __init__(self, bbcon):
+        super(SimMotob, self).__init__(bbcon, motor=SimMotors(bbcon.arena, bbcon.index),
+                                       camera=CameraSensob(sensor=SimCamera(bbcon.arena, bbcon.index)))
+
+
+class SimBbcon(Bbcon):
+
+    motob_class = SimMotob
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+        super(SimBbcon, self).__init__()
+        self.timestep_length = 0
+
+        self.add_behavior(FollowLine(self, ReflectanceSensob(sensor=SimReflectanceSensors(arena, index))))
+        # Sonaren planlegger pingene etter simulert tid; timestepene her tar bare mikrosekunder
+        self.add_behavior(Obstruction(self, u_sensob=UltrasonicSensob(adaptive=True, sensor=SimUltrasonic(arena, index),
+                                                                      clock=arena.clock)))
+        self.add_behavior(Photo(self, CameraSensob(sensor=SimCamera(arena, index)), DiscardFrames()))
+
+
+class Fleet:
+
+    def __init__(self, n_robots, seed=0):
+        self.arena = Arena(n_robots, seed=seed)
+        self.robots = [SimBbcon(self.arena, i) for i in range(n_robots)]
+
+    # Kjører alle robotene ticks timesteps. Utskriftene fra bbcon er slått av, de koster mer enn resten.
+    def run(self, ticks):
+        start = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(ticks):
+                for robot in self.robots:
+                    robot.run_one_timestep()
+                self.arena.step()
+        return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of robots in one process")
+    parser.add_argument('--sizes', default='1,10,100', help="comma separated fleet sizes")
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("%8s %10s %14s %16s" % ("robots", "seconds", "fleet ticks/s", "robot ticks/s"))
+    for n in [int(x) for x in args.sizes.split(',')]:
+        fleet = Fleet(n, args.seed)
+        seconds = fleet.run(args.ticks)
+        print("%8d %10.2f %14.1f %16.1f" % (n, seconds, args.ticks / seconds, n * args.ticks / seconds))
+
+
+if __name__ == "__main__":
+    main()
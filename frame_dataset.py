@@ -0,0 +1,241 @@
+# Datasett med tusenvis av kamerabilder og labels i én fil, for å teste fargedetektorene (og andre Imager-ting)
+# uten roboten. Filen er et fast header etterfulgt av poster med fast størrelse, så den kan memory-mappes og
+# leses som en numpy-array uten å kopiere bildene.
+#
+#   python frame_dataset.py record red.frames --label red --count 200      ta bilder med kameraet på roboten
+#   python frame_dataset.py import photos/ all.frames                      pakk bilder fra en katalog, label = underkatalog
+#   python frame_dataset.py bench all.frames                               kjør detektorene og mål treffrate og fps
+
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'ZFRM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHH')                 # magic, versjon, bredde, høyde, bytes til label
+HEADER_SIZE = 64                                  # headeren fylles ut til 64 bytes, så postene starter på en
+                                                  # rund adresse
+LABEL_SIZE = 16
+
+
+def record_dtype(width, height, label_size=LABEL_SIZE):
+    return np.dtype([('label', 'S%d' % label_size), ('time', '<f8'), ('pixels', np.uint8, (height, width, 3))])
+
+
+class FrameWriter:
+
+    # Legger bilder til på slutten av filen. Finnes filen fra før, må den ha samme bildestørrelse.
+    # Hver post skrives med én write, og en halvskrevet post på slutten (om roboten døde) blir ignorert av
+    # FrameDataset og overskrevet her.
+
+    def __init__(self, path, width=128, height=96):
+        self.path = path
+        self.size = (width, height)
+        self.dtype = record_dtype(width, height)
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            width, height, label_size = read_header(path)
+            if (width, height) != self.size or label_size != LABEL_SIZE:
+                raise ValueError("%s has %dx%d frames, not %dx%d" % ((path, width, height) + self.size))
+            self.file = open(path, 'r+b')
+            complete = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+            self.file.truncate(HEADER_SIZE + complete * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(HEADER.pack(MAGIC, VERSION, width, height, LABEL_SIZE).ljust(HEADER_SIZE, b'\0'))
+        self.record = np.zeros(1, dtype=self.dtype)   # gjenbrukes for hver post
+        self.written = 0
+
+    # image er et PIL-bilde eller en (høyde, bredde, 3) uint8-array. Bilder med feil størrelse skaleres.
+    def append(self, image, label, timestamp=None):
+        if hasattr(image, 'convert'):
+            image = image.convert('RGB')
+            if image.size != self.size:
+                image = image.resize(self.size)
+            image = np.asarray(image)
+        self.record['label'] = (label or 'none').encode()[:LABEL_SIZE]
+        self.record['time'] = time.time() if timestamp is None else timestamp
+        self.record['pixels'] = image
+        self.file.write(self.record.tobytes())
+        self.written += 1
+
+    # Tar et bilde med kameraet og legger det til
+    def capture(self, camera, label):
+        camera.update()
+        self.append(camera.get_value(), label)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, width, height, label_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a frame dataset" % path)
+    return width, height, label_size
+
+
+class FrameDataset:
+
+    # Leser datasettet med np.memmap. Bildene som gis ut er views inn i filen, ikke kopier; de er bare gyldige
+    # så lenge datasettet er åpent og kan ikke endres.
+
+    def __init__(self, path):
+        self.path = path
+        width, height, label_size = read_header(path)
+        self.size = (width, height)
+        dtype = record_dtype(width, height, label_size)
+        count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        self.records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,)) \
+            if count else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    # (høyde, bredde, 3)-view av bilde i
+    def frame(self, i):
+        return self.records['pixels'][i]
+
+    def label(self, i):
+        label = self.records['label'][i].decode()
+        return None if label == 'none' else label
+
+    # Hele datasettet som én (n, høyde, bredde, 3)-view, for detektorer som tar alle bildene på en gang
+    def frames(self):
+        return self.records['pixels']
+
+    def labels(self):
+        return [self.label(i) for i in range(len(self))]
+
+    # Bilde i som et PIL-bilde som deler minne med filen
+    def image(self, i):
+        from PIL import Image
+        return Image.frombuffer('RGB', self.size, self.frame(i), 'raw', 'RGB', 0, 1)
+
+    # Filen lukkes når det ikke finnes flere views inn i den
+    def close(self):
+        self.records = None
+
+
+# Detektorene tar et datasett og en indeks og returnerer 'red', 'green', 'blue' eller None
+
+def detect_classify_color(dataset, i):
+    # Det Photo bruker, via CameraSensob.get_dominant_color
+    from imager2 import Imager
+    return Imager(image=dataset.image(i)).classify_color()[0]
+
+
+def detect_color_sums(dataset, i):
+    from imager2 import Imager
+    return Imager.dominant_band(Imager(image=dataset.image(i)).color_sums())
+
+
+def detect_numpy_sums(dataset, i):
+    from imager2 import Imager
+    return Imager.dominant_band(dataset.frame(i).sum(axis=(0, 1), dtype=np.int64).tolist())
+
+
+DETECTORS = {'classify_color': detect_classify_color, 'color_sums': detect_color_sums,
+             'numpy_sums': detect_numpy_sums}
+
+
+# Kjører detektoren over hele datasettet. Returnerer treffrate, bilder per sekund og en tabell over
+# (label, svar) -> antall.
+def benchmark(dataset, detector):
+    labels = dataset.labels()
+    confusion = {}
+    start = time.perf_counter()
+    answers = [detector(dataset, i) for i in range(len(dataset))]
+    seconds = time.perf_counter() - start
+    for label, answer in zip(labels, answers):
+        confusion[(label, answer)] = confusion.get((label, answer), 0) + 1
+    correct = sum(1 for label, answer in zip(labels, answers) if label == answer)
+    return {'accuracy': correct / len(labels) if labels else None, 'seconds': seconds,
+            'fps': len(labels) / seconds if seconds > 0 else 0.0, 'confusion': confusion}
+
+
+def record(args):
+    import devices
+    camera = devices.camera(args.width, args.height)()
+    with FrameWriter(args.path, args.width, args.height) as writer:
+        for _ in range(args.count):
+            writer.capture(camera, args.label)
+            time.sleep(args.interval)
+    print("Recorded %d frames labelled %s to %s" % (writer.written, args.label, args.path))
+
+
+def import_images(args):
+    from PIL import Image
+    from batch_convert import IMAGE_EXTENSIONS
+    with FrameWriter(args.path, args.width, args.height) as writer:
+        for root, dirs, files in os.walk(args.in_dir):
+            dirs.sort()
+            label = os.path.relpath(root, args.in_dir).split(os.sep)[0]
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    writer.append(Image.open(os.path.join(root, name)), None if label == '.' else label)
+    print("Imported %d frames to %s" % (writer.written, args.path))
+
+
+def bench(args):
+    unknown = [name for name in args.detectors if name not in DETECTORS]
+    if unknown:
+        raise SystemExit("Unknown detectors: " + ', '.join(unknown))
+    dataset = FrameDataset(args.path)
+    print("%d frames of %dx%d from %s" % ((len(dataset),) + dataset.size + (args.path,)))
+    print("%-16s %9s %10s %10s" % ("detector", "accuracy", "seconds", "fps"))
+    for name in args.detectors or sorted(DETECTORS):
+        result = benchmark(dataset, DETECTORS[name])
+        accuracy = '-' if result['accuracy'] is None else '%.3f' % result['accuracy']
+        print("%-16s %9s %10.3f %10.1f" % (name, accuracy, result['seconds'], result['fps']))
+        if args.confusion:
+            for (label, answer), n in sorted(result['confusion'].items(), key=str):
+                print("    %-8s -> %-8s %6d" % (label, answer, n))
+    dataset.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record, pack and benchmark datasets of camera frames")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('record', help="capture frames with the robot camera")
+    p.add_argument('path')
+    p.add_argument('--label', required=True, help="red, green, blue or none")
+    p.add_argument('--count', type=int, default=100)
+    p.add_argument('--interval', type=float, default=0.0, help="seconds between frames")
+    p.set_defaults(func=record)
+
+    p = commands.add_parser('import', help="pack a directory of images, labelled by their top-level subdirectory")
+    p.add_argument('in_dir')
+    p.add_argument('path')
+    p.set_defaults(func=import_images)
+
+    for p in commands.choices.values():
+        p.add_argument('--width', type=int, default=128)
+        p.add_argument('--height', type=int, default=96)
+
+    p = commands.add_parser('bench', help="run the color detectors over a dataset")
+    p.add_argument('path')
+    p.add_argument('detectors', nargs='*', help="detectors to run (default: all): " + ', '.join(sorted(DETECTORS)))
+    p.add_argument('--confusion', action='store_true', help="print (label -> answer) counts")
+    p.set_defaults(func=bench)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+from contextlib import contextmanager
+
+
+class FramePool:
+
+    # Et fast antall ferdig allokerte PIL-bilder som kamera og Imager kan låne og gi tilbake, slik at hvert bilde
+    # ikke trenger et nytt fullt bilde. Er alle lånt ut lages et nytt bilde, og det telles som en miss. Poolen
+    # beholder aldri mer enn count ledige bilder; det som gis tilbake utover det kastes.
+    # Trådsikker, siden FrameSink gir bilder tilbake fra sin egen tråd.
+    # Med lazy=True lages bildene først ved preallocate() eller første lån, f.eks. i devices.warm_up.
+
+    def __init__(self, width=128, height=96, count=4, mode='RGB', lazy=False):
+        self.size = (width, height)
+        self.mode = mode
+        self.count = count
+        self.free = []
+        self.owned = set()
+        self.allocated = False
+        self.lock = threading.Lock()
+        self.borrowed = 0
+        self.returned = 0
+        self.misses = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.discarded = 0
+        if not lazy:
+            self.preallocate()
+
+    def preallocate(self):
+        from PIL import Image
+        with self.lock:
+            if self.allocated:
+                return
+            frames = [Image.new(self.mode, self.size) for _ in range(self.count)]
+            self.free.extend(frames)
+            self.owned.update(id(frame) for frame in frames)
+            self.allocated = True
+
+    def borrow(self):
+        if not self.allocated:
+            self.preallocate()
+        from PIL import Image
+        with self.lock:
+            self.borrowed += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            if self.free:
+                return self.free.pop()
+            self.misses += 1
+            frame = Image.new(self.mode, self.size)
+            self.owned.add(id(frame))
+            return frame
+
+    # Gir et lånt bilde tilbake. Bilder som ikke kommer fra poolen ignoreres.
+    def give_back(self, frame):
+        if frame is None or id(frame) not in self.owned:
+            return
+        from imager2 import Imager
+        # Innholdet blir overskrevet, så eventuelle skalerte kopier i Imager sin cache er ikke lenger gyldige
+        Imager._scale_cache_.invalidate(frame)
+        with self.lock:
+            self.returned += 1
+            self.in_use -= 1
+            if len(self.free) < self.count:
+                self.free.append(frame)
+            else:
+                self.owned.discard(id(frame))
+                self.discarded += 1
+
+    @contextmanager
+    def frame(self):
+        frame = self.borrow()
+        try:
+            yield frame
+        finally:
+            self.give_back(frame)
+
+    def stats(self):
+        with self.lock:
+            return {'free': len(self.free), 'in_use': self.in_use, 'max_in_use': self.max_in_use,
+                    'borrowed': self.borrowed, 'returned': self.returned, 'misses': self.misses,
+                    'discarded': self.discarded}
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class FrameSink:
+
+    # Lagrer bilder i en egen tråd, slik at kontroll-loopen aldri venter på koding eller disk.
+    # Køen har fast størrelse; er disken for treg kastes det eldste bildet i køen.
+    #
+    # format kan være alt PIL kan lagre (gif, png, jpeg, ...), 'raw' for rå RGB-bytes, eller 'npz' for en
+    # komprimert numpy-fil.
+
+    def __init__(self, out_dir='photos', format='png', max_queue=8, prefix='photo', pool=None):
+        self.out_dir = out_dir
+        self.pool = pool                        # bildene gis tilbake til denne FramePool-en når de er skrevet
+        self.format = format
+        self.prefix = prefix
+        self.queue = deque(maxlen=max_queue)
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.frame_no = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="FrameSink", daemon=True)
+        self.thread.start()
+
+    # Skriver ut bildene som allerede ligger i køen før tråden stopper
+    def stop(self, timeout=5):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    # Legger et PIL-bilde i køen. Returnerer umiddelbart.
+    def put(self, image):
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                self.release(self.queue[0][2])
+            self.frame_no += 1
+            self.queue.append((self.frame_no, time.time(), image))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                frame_no, timestamp, image = self.queue.popleft()
+            try:
+                self.write(frame_no, timestamp, image)
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                print("FrameSink could not write frame", frame_no, e)
+            self.release(image)
+
+    def release(self, image):
+        if self.pool:
+            self.pool.give_back(image)
+
+    def write(self, frame_no, timestamp, image):
+        base = os.path.join(self.out_dir, '%s_%06d' % (self.prefix, frame_no))
+        if self.format == 'raw':
+            # Størrelsen står i filnavnet, slik at filen kan leses med Image.frombytes
+            with open('%s_%dx%d.rgb' % (base, image.size[0], image.size[1]), 'wb') as f:
+                f.write(image.convert('RGB').tobytes())
+        elif self.format == 'npz':
+            import numpy as np
+            np.savez_compressed(base + '.npz', frame=np.asarray(image.convert('RGB')), timestamp=timestamp)
+        else:
+            image.save(base + '.' + self.format, format=self.format)
+
+    def stats(self):
+        return {'queued': len(self.queue), 'written': self.written, 'dropped': self.dropped, 'errors': self.errors}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
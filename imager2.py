@@ -1,6 +1,109 @@
 from PIL import Image
 from PIL import ImageFilter
 from PIL import ImageEnhance
+from collections import OrderedDict
+import math
+import os
+import threading
+import weakref
+
+# A bounded LRU cache of resized images, keyed by the identity of the source image and the target size.  Sources
+# are held through weak references, so an entry whose source has been garbage collected can never be returned for
+# a new image that happens to get the same id.  Anything that modifies a source image in place must call
+# invalidate, which Imager.paste and Imager.set_pixel do.
+#
+# The cache itself hands out its images without copying, so they are read-only: before changing one in place, call
+# claim, which Imager.paste and Imager.set_pixel also do.  Imager.resize copies them unless asked for a shared image.
+#
+# One cache is shared by every thread (FramePool.give_back invalidates from the FrameSink thread), so all access
+# goes through a lock.  It is reentrant because the weakref callbacks that call forget can run during garbage
+# collection in the middle of any of the other methods.
+
+class ScaleCache():
+
+    def __init__(self,max_bytes=32*1024*1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # (id(source),width,height) -> (weakref to source, resized image, bytes)
+        self.sizes = {} # id(source) -> set of (width,height) cached for that source
+        self.results = {} # id(resized image) -> key of its entry
+        self.handed = {} # key -> how many callers have been given the resized image itself, not a copy
+        self.nbytes = 0
+        self.hits = 0; self.misses = 0; self.evictions = 0
+        self.lock = threading.RLock()
+
+    # shared says whether the caller keeps the returned image itself, or only copies it
+    def get(self,source,width,height,shared=True):
+        with self.lock:
+            key = (id(source),width,height)
+            entry = self.entries.get(key)
+            if entry and entry[0]() is source:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if shared: self.handed[key] += 1
+                return entry[1]
+            if entry: self.remove(key)
+            self.misses += 1
+            return None
+
+    def put(self,source,width,height,image,shared=True):
+        with self.lock:
+            nbytes = width*height*len(image.getbands())
+            if nbytes > self.max_bytes: return
+            key = (id(source),width,height)
+            if key in self.entries: self.remove(key)
+            ref = weakref.ref(source,lambda r,key=key: self.forget(key,r))
+            self.entries[key] = (ref,image,nbytes)
+            self.sizes.setdefault(key[0],set()).add((width,height))
+            self.results[id(image)] = key
+            self.handed[key] = 1 if shared else 0
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self,key):
+        with self.lock:
+            _, image, nbytes = self.entries.pop(key)
+            self.nbytes -= nbytes
+            del self.results[id(image)]
+            del self.handed[key]
+            sizes = self.sizes.get(key[0])
+            if sizes is not None:
+                sizes.discard(key[1:])
+                if not sizes: del self.sizes[key[0]]
+
+    # Called when a source image is garbage collected
+    def forget(self,key,ref):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] is ref: self.remove(key)
+
+    # Drop every cached size of this source image
+    def invalidate(self,source):
+        with self.lock:
+            for size in list(self.sizes.get(id(source),())):
+                self.remove((id(source),)+size)
+
+    # Returns an image that may be changed in place: image itself, unless it is a cached resize that someone else
+    # may also hold, in which case a copy.  An image only one caller has been given just leaves the cache.
+    def claim(self,image):
+        with self.lock:
+            key = self.results.get(id(image))
+            if key is None or self.entries[key][1] is not image: return image
+            if self.handed[key] > 1: return image.copy()
+            self.remove(key)
+            return image
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear(); self.sizes.clear(); self.results.clear(); self.handed.clear(); self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.nbytes,
+                    'hit_rate': self.hits/total if total else 0.0}
 
 
 class Imager():
@@ -8,11 +111,14 @@ class Imager():
     _pixel_colors_ = {'red':(255,0,0), 'green': (0,255,0), 'blue': (0,0,255), 'white': (255,255,255),
                       'black': (0,0,0)}
 
+    _scale_cache_ = ScaleCache() # Shared by all imagers; see resize
+
     def __init__(self,fid=False,image=False,width=100,height=100,background='black',mode='RGB'):
         self.fid = fid # The image file
         self.image = image # A PIL image object
         self.xmax = width; self.ymax = height # These can change if there's an input image or file
         self.mode = mode
+        self.rng = None # numpy random Generator used by classify_color, created when first needed
         self.init_image(background=background)
 
     def init_image(self,background='black'):
@@ -29,9 +135,9 @@ class Imager():
     # Save image to a file.  Only if fid has no extension is the type argument used.  When writing to a JPEF
     # file, use the extension JPEG, not JPG, which seems to cause some problems.
     def dump_image(self,fid,type='gif'):
-        fname = fid.split('.')
-        type = fname[1] if len(fname) > 1 else type
-        self.image.save(fname[0]+'.'+type,format=type)
+        base, extension = os.path.splitext(fid)
+        type = extension[1:] if extension else type
+        self.image.save(base+'.'+type,format=type)
 
     def get_image(self): return self.image
     def set_image(self,im): self.image = im
@@ -52,16 +158,59 @@ class Imager():
 
     def get_color_rgb(self,colorname): return Imager._pixel_colors_[colorname]
 
-    # This returns a resized copy of the image
-    def resize(self,new_width,new_height,image=False):
+    # This returns a resized version of the image.  Resized images are memoized in _scale_cache_, so asking for
+    # the same size of the same image again only costs a copy.  If out (a PIL image of the new size, e.g. from a
+    # FramePool) is given, the result is copied into it.  With shared=True the image is not copied at all but
+    # shared with the cache, and must be treated as read-only: paste and set_pixel take care of that, but code
+    # changing get_image() directly must use ScaleCache.claim first.
+    def resize(self,new_width,new_height,image=False,out=None,shared=False):
         image = image if image else self.image
-        return Imager(image=image.resize((new_width,new_height)))
-
-    def scale(self,xfactor,yfactor):
-        return self.resize(round(xfactor*self.xmax),round(yfactor*self.ymax))
+        shared = shared and out is None
+        resized = self.cached_resize(image,new_width,new_height,shared)
+        if out is not None: return Imager(image=self.copy_into(resized,out))
+        return Imager(image=resized if shared else resized.copy())
+
+    # Copies image into out, or into a new image if out is None
+    def copy_into(self,image,out=None):
+        if out is None: return image.copy()
+        Imager._scale_cache_.invalidate(out)
+        out.paste(image)
+        return out
+
+    def cached_resize(self,image,new_width,new_height,shared=True):
+        resized = Imager._scale_cache_.get(image,new_width,new_height,shared)
+        if resized is None:
+            resized = image.resize((new_width,new_height))
+            Imager._scale_cache_.put(image,new_width,new_height,resized,shared)
+        return resized
+
+    def scale(self,xfactor,yfactor,shared=False):
+        return self.resize(round(xfactor*self.xmax),round(yfactor*self.ymax),shared=shared)
+
+    # Returns a list of levels+1 imagers, the first being self and each next one scaled by factor relative to the
+    # original.  Levels are built on demand and come from the scale cache if they have been made before; see resize
+    # for shared.
+    def pyramid(self,levels=3,factor=0.5,shared=False):
+        pyr = [self]
+        for level in range(1,levels+1):
+            f = factor**level
+            w = max(1,round(f*self.xmax)); h = max(1,round(f*self.ymax))
+            pyr.append(self.resize(w,h,shared=shared))
+        return pyr
+
+    @staticmethod
+    def scale_cache_stats(): return Imager._scale_cache_.stats()
 
     def get_pixel(self,x,y): return self.image.getpixel((x,y))
-    def set_pixel(self,x,y,rgb): self.image.putpixel((x,y),rgb)
+    def set_pixel(self,x,y,rgb):
+        self.own_image()
+        self.image.putpixel((x,y),rgb)
+
+    # Called before changing self.image in place: makes sure it is not shared with the scale cache, and drops the
+    # cached resizes of it
+    def own_image(self):
+        self.image = Imager._scale_cache_.claim(self.image)
+        Imager._scale_cache_.invalidate(self.image)
 
     def combine_pixels(self,p1,p2,alpha=0.5):
         return tuple([round(alpha*p1[i] + (1 - alpha)*p2[i]) for i in range(3)])
@@ -75,8 +224,8 @@ class Imager():
     # This applies the function to each RGB TUPLE, returning a new tuple to appear in the new image.  So func
     # must return a 3-tuple if the image has RGB pixels.
 
-    def map_image2(self,func,image=False):
-        im2 = image.copy() if image else self.image.copy()
+    def map_image2(self,func,image=False,out=None):
+        im2 = self.copy_into(image if image else self.image,out)
         for i in range(self.xmax):
             for j in range(self.ymax):
                 im2.putpixel((i,j),func(im2.getpixel((i,j))))
@@ -95,6 +244,60 @@ class Imager():
         return self.map_image2(wta,image)
 
 
+    # Sum of each RGB band over the whole image.  The band histograms are computed by PIL, so this is much faster
+    # than visiting every pixel with get_pixel.
+    def color_sums(self,image=False):
+        image = image if image else self.image
+        hist = image.histogram()
+        return [sum(i*count for i,count in enumerate(hist[band*256:(band+1)*256])) for band in range(3)]
+
+    # The name of the band ('red', 'green' or 'blue') whose sum is strictly larger than the other two, or None.
+    @staticmethod
+    def dominant_band(sums):
+        names = ('red','green','blue')
+        w = max(range(3),key=lambda i: sums[i])
+        return names[w] if all(sums[w] > sums[i] for i in range(3) if i != w) else None
+
+    # Same answer as dominant_band(color_sums()), but decided from a sample of the pixels: a grid of about
+    # max_samples pixels at a random offset, taken in one NEAREST resize and shuffled.  The sample is checked in
+    # batches, and after each batch the leading band must beat each of the others by more than z standard errors of
+    # the mean per-pixel difference.  If that does not happen within the sample the whole image is scanned.  Images
+    # with no more than scan_factor*max_samples pixels (the robot's 128x96 frames, for instance) are scanned straight
+    # away, since the histogram in color_sums is faster than sampling them.  Returns (band name or None, number of
+    # pixels looked at).
+    def classify_color(self,image=False,z=3.0,batch=64,max_samples=2048,scan_factor=8):
+        image = image if image else self.image
+        width, height = image.size
+        n_pixels = width*height
+        if n_pixels <= scan_factor*max_samples:
+            return Imager.dominant_band(self.color_sums(image)), n_pixels
+        import numpy as np
+        if self.rng is None: self.rng = np.random.default_rng()
+        gw = max(1,min(width,round(math.sqrt(max_samples*width/height))))
+        gh = max(1,min(height,max_samples//gw))
+        cw, ch = width/gw, height/gh
+        dx, dy = self.rng.uniform(0,cw), self.rng.uniform(0,ch)
+        grid = image.resize((gw,gh),Image.NEAREST,box=(dx,dy,dx+width-cw,dy+height-ch))
+        sample = np.asarray(grid).reshape(gw*gh,-1)[self.rng.permutation(gw*gh),:3].astype(np.int64)
+        pairs = ((0,1),(0,2),(1,2))
+        diffs = sample[:,[i for i,_ in pairs]] - sample[:,[j for _,j in pairs]]
+        # Running sums at the end of each batch, one row per batch
+        ends = np.append(np.arange(batch,len(sample),batch),len(sample))
+        sums = np.cumsum(sample,axis=0)[ends-1]
+        dsums = np.cumsum(diffs,axis=0)[ends-1]
+        dsquares = np.cumsum(diffs*diffs,axis=0)[ends-1]
+        n = ends[:,None]
+        mean = dsums/n
+        var = np.maximum(dsquares/n - mean*mean,0)
+        settled = (np.abs(mean) > z*np.sqrt(var/n)) & (mean != 0)
+        # Only the leading band has to be settled against the two others
+        involved = np.array([[w in pair for pair in pairs] for w in range(3)])
+        done = (settled | ~involved[sums.argmax(axis=1)]).all(axis=1)
+        if done.any():
+            b = int(done.argmax())
+            return Imager.dominant_band(sums[b].tolist()), int(ends[b])
+        return Imager.dominant_band(self.color_sums(image)), n_pixels
+
     # Note that grayscale uses the RGB triple to define shades of gray.
     def gen_grayscale(self,image=False): return self.scale_colors(image=image,degree=0)
 
@@ -103,8 +306,49 @@ class Imager():
         return Imager(image=ImageEnhance.Color(image).enhance(degree))
 
     def paste(self,im2,x0=0,y0=0):
+        self.own_image()
         self.get_image().paste(im2.get_image(),(x0,y0,x0+im2.xmax,y0+im2.ymax))
 
+    ### Vectorized filters.  These work on numpy arrays (see imfilters.py), and share one set of scratch buffers.
+
+    _filters_ = None
+
+    @staticmethod
+    def filters():
+        if Imager._filters_ is None:
+            import imfilters
+            Imager._filters_ = imfilters.Filters()
+        return Imager._filters_
+
+    # The image as a 2D float array: the gray level, or one band ('R', 'G' or 'B') if band is given
+    def gray_array(self,image=False,band=None):
+        import numpy as np
+        image = image if image else self.image
+        image = image.getchannel(band) if band else image.convert('L')
+        return np.asarray(image,dtype=np.float32)
+
+    @staticmethod
+    def from_array(a):
+        import numpy as np
+        return Imager(image=Image.fromarray(np.clip(a,0,255).astype(np.uint8)).convert('RGB'))
+
+    def blur(self,radius=1): return Imager.from_array(Imager.filters().blur(self.gray_array(),radius))
+    def edges(self): return Imager.from_array(Imager.filters().sobel(self.gray_array()))
+
+    # Black and white image, white where the gray level (or band) is above thresh, or below it if below is set
+    def threshold(self,thresh=128,below=False,band=None):
+        mask = Imager.filters().threshold(self.gray_array(band=band),thresh,below)
+        return Imager.from_array(mask*255)
+
+    # Blobs of connected pixels passing the threshold, cleaned by opening (erode, then dilate) when open_radius > 0.
+    # See Filters.blobs for what is returned.
+    def find_blobs(self,thresh=128,below=False,band=None,min_size=1,open_radius=0):
+        f = Imager.filters()
+        mask = f.threshold(self.gray_array(band=band),thresh,below)
+        if open_radius > 0:
+            mask = f.dilate(f.erode(mask,open_radius),open_radius)
+        return f.blobs(mask,min_size)
+
     ### Combining imagers in various ways.
 
     ## The two concatenate operations will handle images of different sizes
@@ -156,7 +400,7 @@ class Imager():
     def tunnel(self,levels=5, scale=0.75):
         if levels == 0: return self
         else:
-            child = self.scale(scale,scale) # child is a scaled copy of self
+            child = self.scale(scale,scale,shared=True) # child is a scaled copy of self; paste claims it
             child.tunnel(levels-1,scale)
             dx = round((1-scale)*self.xmax/2); dy = round((1-scale)*self.ymax/2)
             self.paste(child, dx,dy)
@@ -169,31 +413,32 @@ class Imager():
 
 # Note: the default file paths for these examples are for unix!
 
-def ptest1(fid1='images/kdfinger.jpeg', fid2="images/einstein.jpeg",steps=5,newsize=250):
+def ptest1(fid1='images/kdfinger.jpeg', fid2="images/einstein.jpeg",steps=5,newsize=250,show=True):
     im1 = Imager(fid1); im2 = Imager(fid2)
     im1 = im1.resize(newsize,newsize); im2 = im2.resize(newsize,newsize)
     roll = im1.morphroll(im2,steps=steps)
-    roll.display()
+    if show: roll.display()
     return roll
 
-def ptest2(fid1='images/einstein.jpeg',outfid='images/tunnel.jpeg',levels=3,newsize=250,scale=0.8):
+def ptest2(fid1='images/einstein.jpeg',outfid='images/tunnel.jpeg',levels=3,newsize=250,scale=0.8,show=True):
     im1 = Imager(fid1);
     im1 = im1.resize(newsize,newsize);
     im2 = im1.tunnel(levels=levels,scale=scale)
-    im2.display()
+    if show: im2.display()
     im2.dump_image(outfid)
     return im2
 
-def ptest3(fid1='images/kdfinger.jpeg', fid2="images/einstein.jpeg",newsize=250,levels=4,scale=0.75):
+def ptest3(fid1='images/kdfinger.jpeg', fid2="images/einstein.jpeg",newsize=250,levels=4,scale=0.75,show=True):
     im1 = Imager(fid1); im2 = Imager(fid2)
     im1 = im1.resize(newsize,newsize); im2 = im2.resize(newsize,newsize)
     box = im1.mortun(im2,levels=levels,scale=scale)
-    box.display()
+    if show: box.display()
     return box
 
-def reformat(in_fid, out_ext='jpeg',scalex=1.0,scaley=1.0):
-    base, extension = in_fid.split('.')
+# Converts one image file to the out_ext format.  The converted file is written next to the original unless
+# out_fid is given.
+def reformat(in_fid, out_ext='jpeg',scalex=1.0,scaley=1.0,out_fid=None):
+    base, extension = os.path.splitext(in_fid)
     im = Imager(in_fid)
     im = im.scale(scalex,scaley)
-    im.dump_image(base,out_ext)
-
+    im.dump_image(out_fid if out_fid else base+'.'+out_ext)
@@ -0,0 +1,149 @@
+import numpy as np
+
+# Vectorized image filters that work on 2D numpy arrays (grayscale, or one band of an RGB image).  All the heavy
+# lifting is done by numpy on whole arrays, so the filters are fast enough to run on camera frames inside a control
+# tick.  A Filters object keeps scratch buffers between calls, so filtering a stream of same-sized frames does
+# not allocate new arrays for intermediate results.  Every filter also takes an out array for the result.
+
+SOBEL_X = np.array([[-1,0,1],[-2,0,2],[-1,0,1]],dtype=np.float32)
+
+
+class Filters():
+
+    def __init__(self):
+        self.buffers = {} # (name,shape,dtype) -> array
+
+    # Returns the scratch array with this name, shape and dtype, making it the first time it is asked for
+    def buffer(self,name,shape,dtype=np.float32):
+        key = (name,tuple(shape),np.dtype(dtype))
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = np.empty(shape,dtype=dtype)
+        return buf
+
+    # Box blur done as two 1D passes (rows, then columns) using cumulative sums, so the cost does not depend on
+    # the radius.  Edges are handled by repeating the border pixels.
+    def blur(self,a,radius=1,out=None):
+        out = out if out is not None else np.empty(a.shape,dtype=np.float32)
+        if radius <= 0:
+            out[...] = a
+            return out
+        tmp = self.buffer('blur',a.shape)
+        self._box_1d(a,radius,1,tmp)
+        self._box_1d(tmp,radius,0,out)
+        return out
+
+    def _box_1d(self,a,radius,axis,out):
+        n = a.shape[axis]
+        size = 2*radius + 1
+        pad_shape = list(a.shape); pad_shape[axis] = n + size
+        padded = self.buffer('pad%d' % axis,pad_shape)
+        if axis == 0:
+            padded[0] = 0
+            padded[1:radius+1] = a[:1]; padded[radius+1:radius+1+n] = a; padded[radius+1+n:] = a[-1:]
+            np.cumsum(padded,axis=0,out=padded)
+            np.subtract(padded[size:],padded[:n],out=out)
+        else:
+            padded[:,0] = 0
+            padded[:,1:radius+1] = a[:,:1]; padded[:,radius+1:radius+1+n] = a; padded[:,radius+1+n:] = a[:,-1:]
+            np.cumsum(padded,axis=1,out=padded)
+            np.subtract(padded[:,size:],padded[:,:n],out=out)
+        out /= size
+        return out
+
+    # Correlates a with a 3x3 kernel, repeating the border pixels
+    def _filter3(self,a,kernel,out):
+        padded = self.buffer('pad3',(a.shape[0]+2,a.shape[1]+2))
+        padded[1:-1,1:-1] = a
+        padded[0,1:-1] = a[0]; padded[-1,1:-1] = a[-1]
+        padded[:,0] = padded[:,1]; padded[:,-1] = padded[:,-2]
+        h, w = a.shape
+        out[...] = 0
+        for dy in range(3):
+            for dx in range(3):
+                if kernel[dy,dx]:
+                    out += kernel[dy,dx]*padded[dy:dy+h,dx:dx+w]
+        return out
+
+    # Gradient magnitude from the two Sobel kernels
+    def sobel(self,a,out=None):
+        out = out if out is not None else np.empty(a.shape,dtype=np.float32)
+        gx = self._filter3(a,SOBEL_X,self.buffer('gx',a.shape))
+        gy = self._filter3(a,SOBEL_X.T,self.buffer('gy',a.shape))
+        np.hypot(gx,gy,out=out)
+        return out
+
+    # True where a > thresh (or a < thresh when below is set)
+    def threshold(self,a,thresh,below=False,out=None):
+        out = out if out is not None else np.empty(a.shape,dtype=bool)
+        return np.less(a,thresh,out=out) if below else np.greater(a,thresh,out=out)
+
+    # Binary erosion and dilation with a (2*radius+1) square.  Outside the image counts as background.
+    def erode(self,mask,radius=1,out=None):
+        return self._morph(mask,radius,np.logical_and,True,out)
+
+    def dilate(self,mask,radius=1,out=None):
+        return self._morph(mask,radius,np.logical_or,False,out)
+
+    def _morph(self,mask,radius,op,start,out):
+        out = out if out is not None else np.empty(mask.shape,dtype=bool)
+        h, w = mask.shape
+        padded = self.buffer('morph',(h+2*radius,w+2*radius),bool)
+        padded[...] = False
+        padded[radius:radius+h,radius:radius+w] = mask
+        # Separable: first along rows into rows_out, then along columns into out
+        rows_out = self.buffer('morph_rows',(h+2*radius,w),bool)
+        rows_out[...] = start
+        for dx in range(2*radius+1):
+            op(rows_out,padded[:,dx:dx+w],out=rows_out)
+        out[...] = start
+        for dy in range(2*radius+1):
+            op(out,rows_out[dy:dy+h],out=out)
+        return out
+
+    # Labels the 4-connected components of mask.  Returns an int array where background is 0 and each blob has
+    # its own label.  Labels are spread to neighbours with whole-array minimums, and pointer jumping makes the
+    # number of passes grow slowly with the size of the blobs.
+    def label(self,mask):
+        h, w = mask.shape
+        big = h*w
+        labels = np.where(mask,np.arange(big).reshape(h,w),big)
+        flat = np.empty(big+1,dtype=labels.dtype)
+        while True:
+            old = labels.copy()
+            np.minimum(labels[1:],labels[:-1],out=labels[1:],where=mask[1:])
+            np.minimum(labels[:-1],labels[1:],out=labels[:-1],where=mask[:-1])
+            np.minimum(labels[:,1:],labels[:,:-1],out=labels[:,1:],where=mask[:,1:])
+            np.minimum(labels[:,:-1],labels[:,1:],out=labels[:,:-1],where=mask[:,:-1])
+            # Pointer jumping: every pixel takes the label of the pixel its label points to
+            flat[:big] = labels.ravel(); flat[big] = big
+            labels = flat[labels]
+            if np.array_equal(labels,old):
+                break
+        # Renumber so that the blobs are 1, 2, 3, ... and the background is 0
+        _, inverse = np.unique(labels,return_inverse=True)
+        out = inverse.reshape(h,w) + 1
+        out[~mask] = 0
+        return out
+
+    # Finds blobs in mask and returns them as a list of dicts with size, centroid (x,y) and bounding box
+    # (x0,y0,x1,y1), biggest first.  Blobs smaller than min_size are left out.
+    def blobs(self,mask,min_size=1):
+        if not mask.any():
+            return []
+        labels = self.label(mask)
+        ys, xs = np.nonzero(mask)
+        ids = labels[ys,xs]
+        n = ids.max() + 1
+        sizes = np.bincount(ids,minlength=n)
+        cx = np.bincount(ids,weights=xs,minlength=n)
+        cy = np.bincount(ids,weights=ys,minlength=n)
+        x0 = np.full(n,mask.shape[1]); y0 = np.full(n,mask.shape[0]); x1 = np.zeros(n,int); y1 = np.zeros(n,int)
+        np.minimum.at(x0,ids,xs); np.minimum.at(y0,ids,ys)
+        np.maximum.at(x1,ids,xs); np.maximum.at(y1,ids,ys)
+        found = []
+        for i in np.flatnonzero(sizes >= max(min_size,1)):
+            found.append({'size': int(sizes[i]), 'centroid': (float(cx[i]/sizes[i]), float(cy[i]/sizes[i])),
+                          'bbox': (int(x0[i]),int(y0[i]),int(x1[i]),int(y1[i]))})
+        found.sort(key=lambda b: -b['size'])
+        return found
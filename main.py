@@ -1,23 +1,118 @@
+import time
+import_start = time.time()
+
+import asyncio
+import sys
+
+import devices
+
 from bbcon import Bbcon
 from behavior import *
 from zumo_button import ZumoButton
+from frame_sink import FrameSink
+from frame_pool import FramePool
+
+devices.startup_costs.append(('import main modules', time.time() - import_start))
+
+def add_behaviors(bbcon, c_sensob=None, frame_sink=None):
+    # Med --rules lages linjefølging og hindringer fra reglene i rules.json
+    if "--rules" in sys.argv:
+        import rules
+        for behavior in rules.load(bbcon, "rules.json"):
+            bbcon.add_behavior(behavior)
+    else:
+        bbcon.add_behavior(FollowLine(bbcon))
+        bbcon.add_behavior(Obstruction(bbcon, use_ir="--ir" in sys.argv, adaptive_sonar="--adaptive-sonar" in sys.argv))
+    bbcon.add_behavior(Photo(bbcon, c_sensob, frame_sink))
+
+    # Med --camera-line følges linjen også med kameraet
+    if "--camera-line" in sys.argv:
+        bbcon.add_behavior(CameraFollowLine(bbcon))
+
+
+# Slår på valgfrie ting fra kommandolinjen
+def configure(bbcon):
+    bbcon.load_shedding = "--shed" in sys.argv
+    bbcon.motobs.closed_loop = "--closed-loop" in sys.argv
+    if "--metrics" in sys.argv:
+        bbcon.metrics_file = "metrics.prom"
+    # --telemetry lytter bare lokalt, --telemetry-public på alle nettverkskort
+    if "--telemetry" in sys.argv or "--telemetry-public" in sys.argv:
+        from telemetry import TelemetryPublisher, LOCAL_ADDRESS, PUBLIC_ADDRESS
+        bbcon.telemetry = TelemetryPublisher(PUBLIC_ADDRESS if "--telemetry-public" in sys.argv else LOCAL_ADDRESS)
+        bbcon.telemetry.start()
+
+
+# Lager kamera-sensoben til Photo. Kamerabildene lånes fra en pool, og gis tilbake når FrameSink har skrevet dem.
+# Poolen har plass til en full kø i FrameSink, pluss bildet kameraet tar og det Photo ser på. Med --perception tas
+# og analyseres bildene i en egen prosess. Returnerer (c_sensob, frame_sink, worker), worker er None uten
+# --perception.
+def make_camera():
+    sink_queue = 8
+    pool = FramePool(count=sink_queue + 2, lazy=True)
+    devices.on_warm_up(pool.preallocate)
+
+    worker = None
+    c_sensob = CameraSensob(pool)
+    if "--perception" in sys.argv:
+        from perception import PerceptionWorker, PerceptionSensob
+        worker = PerceptionWorker()
+        worker.start()
+        c_sensob = PerceptionSensob(worker, pool)
+
+    frame_sink = FrameSink(max_queue=sink_queue, pool=pool)
+    frame_sink.start()
+    return c_sensob, frame_sink, worker
+
 
 def main():
 
     bbcon = Bbcon()
-    lineRider = FollowLine(bbcon)
-    obstruction = Obstruction(bbcon)
-    photo = Photo(bbcon)
+    configure(bbcon)
+    c_sensob, frame_sink, worker = make_camera()
+    add_behaviors(bbcon, c_sensob, frame_sink)
+
+    # Enhetene lages og tunge moduler importeres mens vi venter på knappen
+    button = ZumoButton()
+    warm_up = devices.warm_up()
+    button.wait_for_press()
+    warm_up.join()
+    devices.report()
+
+    try:
+        while True:
+            bbcon.run_one_timestep()
+    finally:
+        frame_sink.stop()
+        if worker:
+            worker.stop()
+
 
-    bbcon.add_behavior(lineRider)
-    bbcon.add_behavior(obstruction)
-    bbcon.add_behavior(photo)
+# Samme som main, men med AsyncBbcon
+def main_async():
+    from async_bbcon import AsyncBbcon
 
-    ZumoButton().wait_for_press()
+    loop = asyncio.get_event_loop()
+    bbcon = AsyncBbcon(loop)
+    configure(bbcon)
+    c_sensob, frame_sink, worker = make_camera()
+    add_behaviors(bbcon, c_sensob, frame_sink)
 
-    while True:
-        bbcon.run_one_timestep()
+    button = ZumoButton()
+    warm_up = devices.warm_up()
+    loop.run_until_complete(loop.run_in_executor(None, button.wait_for_press))
+    warm_up.join()
+    devices.report()
+    try:
+        loop.run_until_complete(bbcon.run())
+    finally:
+        frame_sink.stop()
+        if worker:
+            worker.stop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--async" in sys.argv:
+        main_async()
+    else:
+        main()
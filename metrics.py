@@ -0,0 +1,158 @@
+import bisect
+import os
+import socket
+import threading
+import time
+
+# Runtime-statistikk med konstant minnebruk: tellere og histogrammer med faste bøtter.
+# Alle deler REGISTRY, slik at bbcon, arbitrator, motob og sensobs kan registrere uten å sende objekter rundt.
+# Et øyeblikksbilde kan hentes med snapshot(), eller skrives i Prometheus sitt tekstformat med export().
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+
+    # Bøttegrensene dobles fra 10 us til ca. 20 s, så relativ feil på kvantiler er høyst en faktor 2
+    BOUNDS = [0.00001 * 2 ** i for i in range(22)]
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds if bounds else Histogram.BOUNDS
+        self.counts = [0] * (len(self.bounds) + 1)      # siste bøtte er alt over største grense
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Øvre grense for bøtta hvor kvantilen q (0-1) ligger
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Timer:
+
+    # with REGISTRY.timer('navn'): ... måler tiden blokken tar
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.time() - self.start)
+
+
+class Registry:
+
+    def __init__(self):
+        self.counters = {}                      # (navn, labels) -> Counter
+        self.histograms = {}                    # (navn, labels) -> Histogram
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def counter(self, name, **labels):
+        key = self.key(name, labels)
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+        return counter
+
+    def histogram(self, name, **labels):
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def timer(self, name, **labels):
+        return Timer(self.histogram(name, **labels))
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = list(self.histograms.items())
+        return {'counters': {self.format_key(k): c.value for k, c in counters},
+                'histograms': {self.format_key(k): h.snapshot() for k, h in histograms}}
+
+    @staticmethod
+    def format_key(key, extra=()):
+        name, labels = key
+        labels = labels + tuple(extra)
+        if not labels:
+            return name
+        return name + '{' + ','.join('%s="%s"' % (k, v) for k, v in labels) + '}'
+
+    # Prometheus tekstformat
+    def to_prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        for key, counter in counters:
+            lines.append('%s %s' % (self.format_key(key), counter.value))
+        for key, h in histograms:
+            name, labels = key
+            cumulative = 0
+            for bound, c in zip(h.bounds + [float('inf')], h.counts):
+                cumulative += c
+                le = '+Inf' if bound == float('inf') else '%g' % bound
+                lines.append('%s %d' % (self.format_key((name + '_bucket', labels), [('le', le)]), cumulative))
+            lines.append('%s %r' % (self.format_key((name + '_sum', labels)), h.sum))
+            lines.append('%s %d' % (self.format_key((name + '_count', labels)), h.count))
+        return '\n'.join(lines) + '\n'
+
+    # Skriver til en fil (via en midlertidig fil, så den som leser aldri ser en halvskrevet fil)
+    def export(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    # Sender til en socket: en sti til en Unix-socket, eller (host, port) for TCP
+    def send(self, address, timeout=0.5):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(address)
+            s.sendall(self.to_prometheus().encode())
+
+
+REGISTRY = Registry()
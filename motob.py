@@ -1,16 +1,65 @@
-from motors import Motors
-from sensob import CameraSensob
+import time
+import devices
+from sensob import CameraSensob, ReflectanceSensob
 from time import sleep
+from metrics import REGISTRY
+
+
+class Turn:
+
+    # En closed-loop sving: hjulene går til done() returnerer True, eller til varigheten i bevegelsen er brukt opp.
+    # Er calibrates sann, betyr done() at roboten har snudd nøyaktig degrees grader, og tiden brukes til å lære
+    # hvor fort roboten svinger.
+
+    def __init__(self, degrees, done, calibrates=False):
+        self.degrees = degrees
+        self.done = done
+        self.calibrates = calibrates
 
 
 class Motob:
 
-    def __init__(self, bbcon):
+    NOMINAL_TURN_RATE = 1 / 0.0028              # grader per sekund på full fart, slik den er målt på en ny robot
+
+    def __init__(self, bbcon, motor=None, camera=None):
         self.bbcon = bbcon
         self.values = []
-        self.motor = Motors()
+        # Motorene og kameraet lages først når de brukes, se devices.py
+        self.motor_device = devices.device('motors', devices.motors) if motor is None else None
+        self._motor = motor
         self.photograph = False
-        self.camera=CameraSensob()
+        self._camera = camera
+        self.speed = 0                          # farten fremover i siste kommando, som andel av full fart
+
+        # Closed-loop svinger: l, r og t avsluttes når linjen er under reflektanssensorene, i stedet for etter en
+        # fast tid. Tiden regnes fortsatt ut fra turn_rate, men brukes bare som øvre grense.
+        self.closed_loop = False
+        self._line_sensob = None
+        self.turn_rate = Motob.NOMINAL_TURN_RATE  # lært fra svingene, endres når batteriet eller underlaget gjør det
+        self.turn_learning = 0.2                # hvor mye hver måling flytter turn_rate
+        self.turn_margin = 1.5                  # closed-loop svinger gis så mange ganger forventet tid
+        self.turn_poll = 0.005                  # sekunder mellom hver sjekk av sensoren
+        self.turn_min_fraction = 0.5            # andel av forventet tid en l- eller r-sving minst varer, se line_turn
+
+    @property
+    def motor(self):
+        if self._motor is None:
+            self._motor = self.motor_device.get()
+        return self._motor
+
+    @property
+    def camera(self):
+        # Brukes bare av den sjeldne 'p'-kommandoen
+        if self._camera is None:
+            self._camera = CameraSensob()
+        return self._camera
+
+    @property
+    def line_sensob(self):
+        # Deler reflektanssensorene med FollowLine, se devices.py
+        if self._line_sensob is None:
+            self._line_sensob = ReflectanceSensob()
+        return self._line_sensob
 
     def update(self, motor_recommendation):
         # Mottar en anbefaling fra bbcon og behaviors
@@ -24,36 +73,129 @@ class Motob:
 
         value=self.values[0]
         print("Motor Recommendation = ", value)
+        REGISTRY.counter('motor_commands_total', command=value).inc()
+        moves = self.get_moves()
+        self.set_speed(moves)
+        for speeds, duration, turn in moves:
+            if turn:
+                self.closed_loop_turn(speeds, duration, turn)
+            else:
+                self.motor.set_value(speeds, duration)
+        self.finish_moves()
+
+    # Svinger til turn.done() er sann, men ikke lenger enn duration
+    def closed_loop_turn(self, speeds, duration, turn):
+        start = time.time()
+        self.motor.set_value(speeds)
+        reached = turn.done()
+        while not reached and time.time() - start < duration:
+            sleep(self.turn_poll)
+            reached = turn.done()
+        self.motor.stop()
+        self.learn_turn_rate(speeds, turn, time.time() - start, reached)
+
+    def learn_turn_rate(self, speeds, turn, elapsed, reached):
+        REGISTRY.histogram('motob_turn_seconds').observe(elapsed)
+        REGISTRY.counter('motob_turns_total', result='reached' if reached else 'timeout').inc()
+        # Bare svinger som nådde målet sier noe om farten. En sving som går ut på tid kan like gjerne bety at
+        # linjen aldri kom tilbake, f.eks. fordi roboten stod utenfor linjen.
+        power = abs(speeds[0] - speeds[1]) / 2
+        if not reached or not turn.calibrates or not elapsed or not power:
+            return
+        measured = turn.degrees / (elapsed * power)
+        measured = min(max(measured, 0.5 * Motob.NOMINAL_TURN_RATE), 2 * Motob.NOMINAL_TURN_RATE)
+        self.turn_rate += self.turn_learning * (measured - self.turn_rate)
+
+    def set_speed(self, moves):
+        # Gjennomsnittet av hjulene i første bevegelse. Svinger på stedet gir 0.
+        self.speed = sum(moves[0][0]) / 2 if moves else 0
+
+    def get_moves(self):
+        # Oversetter anbefalingen til en liste med ([venstre, hoyre], varighet, turn), slik at både den vanlige og
+        # asyncio-varianten av bbcon kan kjøre de samme bevegelsene. turn er None for vanlige bevegelser, ellers en
+        # Turn, og varigheten er da en øvre grense.
+        value = self.values[0]
         if value == "f":
             print("Forward")
-            self.motor.set_value([0.5, 0.5],0.15)
+            return [([0.5, 0.5], 0.15, None)]
         elif value == "l":
             print("Left")
-            self.motor.set_value([-1,1], self.turn_n_degrees(self.values[1]))
+            turn = self.turn_until()
+            return [([-1, 1], self.turn_timeout(self.values[1], turn), turn)]
         elif value == "r":
             print("Right")
-            self.motor.set_value([1,-1], self.turn_n_degrees(self.values[1]))
+            turn = self.turn_until()
+            return [([1, -1], self.turn_timeout(self.values[1], turn), turn)]
         elif value == 'fl':
             print('Left and forward')
-            self.motor.set_value([0.05, 0.35],0.15)
+            return [([0.05, 0.35], 0.15, None)]
         elif value == 'fr':
             print('Right and forward')
-            self.motor.set_value([0.35, 0.05],0.15)
+            return [([0.35, 0.05], 0.15, None)]
         elif value == 't':
-            self.motor.set_value([-0.5, 0.5], 0.25)
-            self.motor.set_value([0.5, -0.5], 0.25)
             print("Found red!")
-            self.motor.set_value([-1, 1], self.turn_n_degrees(180))
-            self.bbcon.photo_taken()
+            # Linjen forsvinner under svingen og kommer tilbake etter 180 grader, så den svingen kalibrerer turn_rate
+            turn = Turn(180, self.line_reacquired(), calibrates=True) if self.closed_loop else None
+            return [([-0.5, 0.5], 0.25, None), ([0.5, -0.5], 0.25, None), ([-1, 1], self.turn_timeout(180, turn), turn)]
         elif value == "s":
             print("Stop")
-            self.motor.stop()
+            return [([0, 0], 1, None)]
+        elif value == 'd':
+            # Kjør med gitt fart på venstre og høyre hjul, ['d', venstre, høyre]
+            print('Drive', self.values[1], self.values[2])
+            return [([self.values[1], self.values[2]], 0.15, None)]
+        return []
+
+    # Hva som avslutter en l- eller r-sving. En behavior kan gi sin egen betingelse, ['l', grader, done], f.eks.
+    # UltrasonicSensob.path_clear. Ellers stopper closed-loop svinger når linjen er midt under sensorene, se line_turn.
+    def turn_until(self):
+        if len(self.values) > 2 and callable(self.values[2]):
+            return Turn(self.values[1], self.values[2])
+        if self.closed_loop:
+            return Turn(self.values[1], self.line_turn(self.values[1]))
+        return None
+
+    # Sann når linjen er midt under sensorene og roboten faktisk har svingt: enten har linjen vært borte fra midten
+    # siden svingen startet, eller så har svingen vart minst turn_min_fraction av forventet tid. Ved et hjørne er
+    # linjen ofte under midtsensorene allerede når FollowLine ber om svingen, og da skal den ikke stoppe med en gang.
+    def line_turn(self, deg):
+        lost = [False]
+        earliest = [None]
+        min_time = self.turn_n_degrees(deg) * self.turn_min_fraction
+
+        def done():
+            now = time.time()
+            if earliest[0] is None:
+                earliest[0] = now + min_time
+            centered = self.line_sensob.line_centered()
+            lost[0] = lost[0] or not centered
+            return centered and (lost[0] or now >= earliest[0])
+        return done
+
+    # Sann når linjen først har forsvunnet og så er midt under sensorene igjen
+    def line_reacquired(self):
+        lost = [False]
+
+        def done():
+            centered = self.line_sensob.line_centered()
+            lost[0] = lost[0] or not centered
+            return lost[0] and centered
+        return done
+
+    def turn_timeout(self, deg, turn):
+        # Closed-loop svinger får litt mer tid enn forventet før de gir opp
+        return self.turn_n_degrees(deg) * (self.turn_margin if turn else 1)
+
+    def finish_moves(self):
+        # Sideeffekter som skal skje etter at bevegelsene er kjørt
+        value = self.values[0]
+        if value == 't':
+            self.bbcon.photo_taken()
+        elif value == "s":
             self.photograph = True
-            sleep(1)
         elif value == 'p':
             self.camera.update()
 
-    @staticmethod
-    def turn_n_degrees(deg):
+    def turn_n_degrees(self, deg):
         # Returnerer antall sekunder motorene må kjøres på full speed, henholdsvis frem og bak for å tilsvare grader
-        return 0.0028 * deg
+        return deg / self.turn_rate
@@ -0,0 +1,156 @@
+import struct
+import time
+from multiprocessing import Event, Process
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from imager2 import Imager
+from sensob import Sensob, CHEAP
+
+# Header i starten av delt minne: sekvensnummer, bildenummer, når bildet begynte å bli tatt (time.time()) og summen
+# av R, G og B i bildet. Sekvensnummeret er oddetall mens workeren skriver, slik at leseren kan se om den fikk et
+# halvskrevet bilde.
+HEADER = struct.Struct('<QQdQQQ')
+
+
+def frame_size(width, height):
+    return HEADER.size + width * height * 3
+
+
+# Kjøres i perception-prosessen. Eier kameraet, analyserer bildene og skriver resultatet til delt minne.
+def run_worker(shm_name, width, height, rotation, stop_event, interval):
+    from camera import Camera
+    from imager2 import Imager
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    camera = Camera(width, height, rotation)
+    seq = 0
+    frame_no = 0
+    try:
+        while not stop_event.is_set():
+            captured = time.time()
+            image = camera.update()
+            if image.size != (width, height):
+                image = image.resize((width, height))
+            sums = Imager(image=image).color_sums()
+            frame_no += 1
+
+            seq += 1
+            HEADER.pack_into(shm.buf, 0, seq, frame_no, captured, *sums)
+            shm.buf[HEADER.size:frame_size(width, height)] = image.tobytes()
+            seq += 1
+            HEADER.pack_into(shm.buf, 0, seq, frame_no, captured, *sums)
+
+            if interval:
+                stop_event.wait(interval)
+    finally:
+        shm.close()
+
+
+class PerceptionWorker:
+
+    # Starter en egen prosess som tar og analyserer bilder, slik at kamera og Imager ikke deler GIL med
+    # kontroll-loopen. Siste bilde og analyse ligger i multiprocessing.shared_memory.
+
+    def __init__(self, img_width=128, img_height=96, img_rot=0, interval=0):
+        self.img_width = img_width
+        self.img_height = img_height
+        self.img_rot = img_rot
+        self.interval = interval                # pause mellom hvert bilde i sekunder
+        self.shm = None
+        self.process = None
+        self.stop_event = Event()
+
+    def start(self):
+        self.shm = shared_memory.SharedMemory(create=True, size=frame_size(self.img_width, self.img_height))
+        HEADER.pack_into(self.shm.buf, 0, 0, 0, 0.0, 0, 0, 0)
+        self.stop_event.clear()
+        self.process = Process(target=run_worker, daemon=True,
+                               args=(self.shm.name, self.img_width, self.img_height, self.img_rot,
+                                     self.stop_event, self.interval))
+        self.process.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    # Returnerer (bildenummer, tidspunkt bildet ble tatt, [r, g, b], bytes) for siste ferdige bilde, eller None hvis
+    # ingen bilder er tatt
+    def read_latest(self, retries=10):
+        size = frame_size(self.img_width, self.img_height)
+        for _ in range(retries):
+            seq, frame_no, captured, r, g, b = HEADER.unpack_from(self.shm.buf, 0)
+            if seq % 2:
+                time.sleep(0.001)
+                continue
+            if frame_no == 0:
+                return None
+            pixels = bytes(self.shm.buf[HEADER.size:size])
+            if HEADER.unpack_from(self.shm.buf, 0)[0] == seq:
+                return frame_no, captured, [r, g, b], pixels
+        return None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class PerceptionSensob(Sensob):
+
+    # Samme grensesnitt som CameraSensob, men henter siste bilde fra PerceptionWorker i stedet for å ta bildet selv
+
+    def __init__(self, worker, pool=None):
+        super(PerceptionSensob, self).__init__()
+        self.worker = worker
+        self.pool = pool                          # FramePool, se CameraSensob
+        self.cost = CHEAP                         # leser bare fra delt minne
+        self.frame_no = 0
+        self.color_sums = None
+        self.not_before = 0.0                     # bilder som ble påbegynt før dette tidspunktet er for gamle
+
+    # Returnerer siste bilde fra workeren, eller None hvis det ikke finnes et bilde som ble påbegynt etter
+    # not_before. Photo setter not_before til når roboten stoppet, så bildet ikke er tatt mens den kjørte.
+    def update(self):
+        latest = self.worker.read_latest()
+        if latest is None or latest[1] < self.not_before:
+            return None
+        self.frame_no, _, self.color_sums, pixels = latest
+        if self.pool:
+            self.pool.give_back(self.value)
+            self.value = self.pool.borrow()
+            self.value.frombytes(pixels)
+        else:
+            self.value = Image.frombytes('RGB', (self.worker.img_width, self.worker.img_height), pixels)
+        return self.value
+
+    def take(self):
+        value = self.value
+        self.value = None
+        return value
+
+    def get_value(self):
+        return self.value                         # returnerer value som en RGB-array
+
+    # Summen av R, G og B, allerede regnet ut i perception-prosessen
+    def get_color_sums(self):
+        return self.color_sums
+
+    def get_dominant_color(self):
+        if self.color_sums is None:
+            return None
+        return Imager.dominant_band(self.color_sums)
+
+    def reset(self):
+        return
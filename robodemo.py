@@ -3,11 +3,13 @@ __author__ = 'keithd'
 from time import sleep
 import random
 import imager2 as IMR
-from reflectance_sensors import ReflectanceSensors
-from camera import Camera
-from motors import Motors
-from ultrasonic import Ultrasonic
-from zumo_button import ZumoButton
+
+# The device modules need the robot's hardware, so they are only imported when a demo runs without being given
+# devices.  scenarios.py runs the demos headless with stand-in devices.
+
+def wait_for_button():
+    from zumo_button import ZumoButton
+    ZumoButton().wait_for_press()
 
 
 
@@ -16,9 +18,11 @@ from zumo_button import ZumoButton
 
 # This just moves the robot around in a fixed dance pattern.  It uses no sensors.
 
-def dancer():
-    ZumoButton().wait_for_press()
-    m = Motors()
+def dancer(m=None):
+    if m is None:
+        from motors import Motors
+        wait_for_button()
+        m = Motors()
     m.forward(.2,3)
     m.backward(.2,3)
     m.right(.5,3)
@@ -31,15 +35,20 @@ def dancer():
 # This tests the UV (distance) sensors.  The robot moves forward to within 10 cm of the nearest obstacle.  It
 # then does a little dancing before backing up to approximately 50 cm from the nearest obstacle.
 
-def explorer(dist=10):
-    ZumoButton().wait_for_press()
-    m = Motors(); u = Ultrasonic()
+def explorer(dist=10,m=None,u=None,wait=sleep):
+    if m is None:
+        from motors import Motors
+        wait_for_button()
+        m = Motors()
+    if u is None:
+        from ultrasonic import Ultrasonic
+        u = Ultrasonic()
     while u.update() > dist:
         m.forward(.2,0.2)
     m.backward(.1,.5)
     m.left(.5,3)
     m.right(.5,3.5)
-    sleep(2)
+    wait(2)
     while u.update() < dist*5:
         m.backward(.2,0.2)
     m.left(.75,5)
@@ -48,14 +57,17 @@ def explorer(dist=10):
 
 def random_step(motors,speed=0.25,duration=1):
     dir = random.choice(['forward','backward','left','right'])
-    eval('Motors.'+ dir)(motors,speed,duration)
+    getattr(motors,dir)(speed,duration)
 
 # This moves around randomly until it gets to a dark spot on the floor (detected with the infrared belly sensors).
 # It then rotates around, snapping pictures as it goes.  It then pastes all the pictures together into a
 # panoramo view, many of which may be created per "vacation".
 
 def tourist(steps=25,shots=5,speed=.25):
-    ZumoButton().wait_for_press()
+    from reflectance_sensors import ReflectanceSensors
+    from camera import Camera
+    from motors import Motors
+    wait_for_button()
     rs = ReflectanceSensors(); m = Motors(); c = Camera()
     for i in range(steps):
         random_step(m,speed=speed,duration=0.5)
@@ -74,9 +86,10 @@ def shoot_panorama(camera,motors,shots=5):
     return im
 
 def calc():
+    from motors import Motors
     m = Motors()
     while True:
-        ZumoButton().wait_for_press()
+        wait_for_button()
         sleep(1)
         m.set_value([-1, 1], 90 * 0.00228)
         sleep(1)
@@ -0,0 +1,169 @@
+import json
+import math
+import threading
+
+import numpy as np
+
+from behavior import Behavior
+from sensob import ReflectanceSensob, UltrasonicSensob, IRProximitySensob
+
+# Behaviors beskrevet som regler i en JSON-fil i stedet for Python-kode. Hver behavior har en liste med regler,
+# og den første regelen hvor alle betingelsene er sanne bestemmer motor-anbefalingen:
+#
+#   {"behaviors": [
+#     {"name": "Obstruction", "priority": 1, "halt": true,
+#      "rules": [{"if": ["sonar < 10"], "do": ["s"], "match": 1}]}
+#   ]}
+#
+# En betingelse er "<feature> <op> <tall>", se FEATURES. Regler uten betingelser slår alltid til. Matcher ingen
+# regel, er behavioren inaktiv. Ved oppstart kompileres alle reglene til én DecisionTable, som leser sensobsene og
+# evaluerer alle behaviors med noen få numpy-operasjoner én gang per timestep.
+
+# Kilde -> (sensob-fabrikk, featurene den gir, funksjon som gjør sensob-verdien om til featurene).
+# Verdier som mangler blir NaN, og da er alle sammenligninger med dem usanne.
+FEATURES = {
+    'reflectance': (ReflectanceSensob,
+                    ['reflectance.%d' % i for i in range(6)] + ['reflectance.min', 'reflectance.max'],
+                    lambda v: list(v) + [min(v), max(v)] if v else [math.nan] * 8),
+    'sonar': (UltrasonicSensob, ['sonar'],
+              lambda v: [math.nan if v is None else v]),
+    'ir': (IRProximitySensob, ['ir.left', 'ir.right'],
+           lambda v: [float(v[0]), float(v[1])] if v else [math.nan] * 2),
+}
+
+OPS = ['<', '<=', '>', '>=', '==', '!=']
+COMPARE = [np.less, np.less_equal, np.greater, np.greater_equal, np.equal, np.not_equal]
+
+
+def parse_condition(text):
+    parts = text.split()
+    if len(parts) != 3 or parts[1] not in OPS:
+        raise ValueError("Condition must be '<feature> <op> <number>', got %r" % text)
+    feature, op, value = parts
+    source = feature.split('.')[0]
+    if source not in FEATURES or feature not in FEATURES[source][1]:
+        raise ValueError("Unknown feature %r in condition %r" % (feature, text))
+    return feature, OPS.index(op), float(value)
+
+
+class DecisionTable:
+
+    # Alle reglene til alle behaviors som tabeller. Betingelse c sammenligner features[feature[c]] med
+    # threshold[c], og member[r, c] sier om betingelse c hører til regel r. Regel r slår til når alle
+    # betingelsene den har er sanne.
+
+    def __init__(self, bbcon, spec):
+        self.bbcon = bbcon
+        self.specs = spec['behaviors']
+        self.lock = threading.Lock()
+        self.evaluated = None                   # timestepet tabellen sist ble evaluert for
+
+        conditions = []                         # (feature, op, terskel)
+        rules = []                              # (behavior-indeks, betingelsene, spesifikasjonen)
+        for b, behavior in enumerate(self.specs):
+            for rule in behavior['rules']:
+                parsed = [parse_condition(c) for c in rule.get('if', [])]
+                rules.append((b, list(range(len(conditions), len(conditions) + len(parsed))), rule))
+                conditions.extend(parsed)
+
+        # Bare kildene reglene bruker leses, og hver sensob bare én gang per timestep
+        used = {feature for feature, _, _ in conditions}
+        self.sources = [s for s in FEATURES if any(f in used for f in FEATURES[s][1])]
+        self.sensobs = {source: FEATURES[source][0]() for source in self.sources}
+        names = [f for source in self.sources for f in FEATURES[source][1]]
+        self.features = np.full(len(names), np.nan)
+
+        # Betingelsene gruppert på operator, så hver operator blir én numpy-sammenligning
+        feature_index = np.array([names.index(f) for f, _, _ in conditions], dtype=int)
+        thresholds = np.array([t for _, _, t in conditions], dtype=float)
+        ops = np.array([op for _, op, _ in conditions], dtype=int)
+        self.groups = []
+        for op, compare in enumerate(COMPARE):
+            idx = np.flatnonzero(ops == op)
+            if len(idx):
+                self.groups.append((compare, idx, feature_index[idx], thresholds[idx]))
+        self.condition_values = np.zeros(len(conditions), dtype=bool)
+
+        self.member = np.zeros((len(rules), len(conditions)), dtype=int)
+        for r, (_, members, _) in enumerate(rules):
+            self.member[r, members] = 1
+        self.needed = self.member.sum(axis=1)
+
+        # rule_index[b, k] er regel nummer k til behavior b. Ledige plasser peker på en ekstra regel som aldri
+        # slår til.
+        width = max([len(b['rules']) for b in self.specs] + [1])
+        self.rule_index = np.full((len(self.specs), width), len(rules), dtype=int)
+        for b in range(len(self.specs)):
+            members = [r for r, rule in enumerate(rules) if rule[0] == b]
+            self.rule_index[b, :len(members)] = members
+        self.rules = [rule for _, _, rule in rules]
+
+        self.chosen = [None] * len(self.specs)  # regelen som slo til for hver behavior, eller None
+
+    # Leser sensobsene og velger regel for alle behaviors. Gjøres bare én gang per timestep, av den første
+    # behavioren som oppdateres.
+    def evaluate(self):
+        with self.lock:
+            if self.evaluated == self.bbcon.num_timesteps:
+                return
+            self.evaluated = self.bbcon.num_timesteps
+            self.read_features()
+
+            for compare, idx, features, thresholds in self.groups:
+                self.condition_values[idx] = compare(self.features[features], thresholds)
+            matched = np.append(self.member @ self.condition_values == self.needed, False)
+
+            table = matched[self.rule_index]
+            first = table.argmax(axis=1)
+            for b, hit in enumerate(table.any(axis=1)):
+                self.chosen[b] = self.rules[self.rule_index[b, first[b]]] if hit else None
+
+    def read_features(self):
+        start = 0
+        for source in self.sources:
+            sensob = self.sensobs[source]
+            if source == 'sonar':
+                # Sonaren pinger oftere jo fortere vi kjører, som i Obstruction
+                sensob.set_speed(self.bbcon.motobs.speed)
+            values = FEATURES[source][2](sensob.update())
+            self.features[start:start + len(values)] = values
+            start += len(values)
+
+    def behaviors(self):
+        return [RuleBehavior(self.bbcon, self, b) for b in range(len(self.specs))]
+
+
+class RuleBehavior(Behavior):
+
+    def __init__(self, bbcon, table, index):
+        super(RuleBehavior, self).__init__(bbcon)
+        spec = table.specs[index]
+        self.table = table
+        self.index = index
+        self.name = spec['name']
+        self.priority = spec.get('priority', 0.5)
+        self.halt = spec.get('halt', False)     # aktiv behavior ber arbitratoren om å velge den
+        used = {c.split()[0].split('.')[0] for rule in spec['rules'] for c in rule.get('if', [])}
+        self.sensobs = [table.sensobs[source] for source in table.sources if source in used]
+
+    def update(self):
+        self.table.evaluate()
+        rule = self.table.chosen[self.index]
+        self.active_flag = rule is not None
+        self.halt_request = self.active_flag and self.halt
+        if not self.active_flag:
+            self.bbcon.deactivate_behavior(self)
+            self.weight = 0
+            return
+
+        self.bbcon.activate_behavior(self)
+        self.motor_recommendations = list(rule['do'])
+        self.match_degree = rule.get('match', 1)
+        self.weight = self.priority * self.match_degree
+
+
+# Leser reglene fra path og returnerer en behavior per behavior i filen
+def load(bbcon, path):
+    with open(path) as f:
+        spec = json.load(f)
+    return DecisionTable(bbcon, spec).behaviors()
@@ -0,0 +1,203 @@
+# Headless versjon av demoene i robodemo.py og bildetestene i imager2.py, pluss et kontroller-scenario fra
+# fleet_sim. Kjører uten Pi, skjerm eller images/-katalogen: motor og sonar byttes ut med stand-ins, og
+# bildene lages syntetisk. Hvert scenario tidtas og sammenlignes med lagrede baselines.
+#
+#   python scenarios.py                       kjør alle og sammenlign med scenario_baselines.json
+#   python scenarios.py --save-baselines      lagre resultatet som nye baselines
+#   python scenarios.py dancer ptest2         kjør bare noen av scenarioene
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenario_baselines.json')
+
+
+class StandInMotors:
+
+    # Samme grensesnitt som Motors. Kommandoene logges og posisjonen regnes ut, men ingenting sover med mindre
+    # time_scale > 0 (1 gir samme tid som på roboten).
+
+    def __init__(self, time_scale=0.0, max_speed=50.0):
+        self.time_scale = time_scale
+        self.max_speed = max_speed              # cm/s ved full fart
+        self.commands = []
+        self.position = 0.0                     # cm kjørt fremover
+        self.driven_time = 0.0
+        self.dc = 0
+        self.speeds = [0, 0]
+
+    def forward(self, speed=0.25, dur=None):
+        self.set_value([speed, speed], dur)
+
+    def backward(self, speed=0.25, dur=None):
+        self.set_value([-speed, -speed], dur)
+
+    def left(self, speed=0.25, dur=None):
+        self.set_value([-speed, speed], dur)
+
+    def right(self, speed=0.25, dur=None):
+        self.set_value([speed, -speed], dur)
+
+    def stop(self):
+        self.dc = 0
+        self.speeds = [0, 0]
+
+    def set_value(self, val, dur=None):
+        self.commands.append((tuple(val), dur))
+        self.speeds = list(val)
+        self.persist(dur)
+
+    def persist(self, duration):
+        if duration:
+            self.position += (self.speeds[0] + self.speeds[1]) / 2 * self.max_speed * duration
+            self.driven_time += duration
+            if self.time_scale:
+                time.sleep(duration * self.time_scale)
+            self.stop()
+
+
+class StandInUltrasonic:
+
+    # Avstanden til en vegg start cm foran startpunktet, målt fra hvor langt motorene har kjørt
+
+    def __init__(self, motors, start=100.0):
+        self.motors = motors
+        self.start = start
+        self.value = None
+
+    def update(self):
+        self.value = max(self.start - self.motors.position, 0.0)
+        return self.value
+
+    def get_value(self):
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+# Syntetiske erstatninger for images/kdfinger.jpeg og images/einstein.jpeg
+def make_images(directory, size=320):
+    from PIL import Image
+    import numpy as np
+
+    y, x = np.mgrid[0:size, 0:size].astype(float) / size
+    radial = np.hypot(x - 0.5, y - 0.5)
+    finger = np.stack([255 * (1 - radial), 128 + 127 * np.sin(20 * radial), 255 * x], axis=2)
+    checker = ((x * 8).astype(int) + (y * 8).astype(int)) % 2
+    einstein = np.stack([255 * checker, 255 * y, 255 * (1 - y) * checker], axis=2)
+
+    paths = {}
+    for name, pixels in (('kdfinger', finger), ('einstein', einstein)):
+        path = os.path.join(directory, name + '.jpeg')
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, format='jpeg')
+        paths[name] = path
+    return paths
+
+
+def scenario_dancer(ctx):
+    import robodemo
+    m = StandInMotors()
+    robodemo.dancer(m)
+    return {'commands': len(m.commands), 'driven_seconds': m.driven_time}
+
+
+def scenario_explorer(ctx):
+    import robodemo
+    m = StandInMotors()
+    robodemo.explorer(m=m, u=StandInUltrasonic(m), wait=lambda seconds: None)
+    return {'commands': len(m.commands), 'driven_seconds': m.driven_time}
+
+
+def scenario_ptest1(ctx):
+    import imager2
+    imager2.ptest1(ctx['kdfinger'], ctx['einstein'], show=False)
+
+
+def scenario_ptest2(ctx):
+    import imager2
+    imager2.ptest2(ctx['einstein'], os.path.join(ctx['dir'], 'tunnel.jpeg'), show=False)
+
+
+def scenario_ptest3(ctx):
+    import imager2
+    imager2.ptest3(ctx['kdfinger'], ctx['einstein'], show=False)
+
+
+def scenario_controller(ctx):
+    import fleet_sim
+    fleet = fleet_sim.Fleet(10)
+    fleet.run(20)
+    return {'robot_ticks': 10 * 20}
+
+
+SCENARIOS = [('dancer', scenario_dancer), ('explorer', scenario_explorer), ('ptest1', scenario_ptest1),
+             ('ptest2', scenario_ptest2), ('ptest3', scenario_ptest3), ('controller', scenario_controller)]
+
+
+# Kjører scenarioet repeat ganger og returnerer beste tid
+def run_scenario(func, ctx, repeat):
+    best = None
+    info = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        info = func(ctx)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, info
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the headless benchmark scenarios")
+    parser.add_argument('names', nargs='*', help="scenarios to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="fail if a scenario is this many times slower than its baseline")
+    parser.add_argument('--baselines', default=BASELINE_FILE)
+    parser.add_argument('--save-baselines', action='store_true')
+    args = parser.parse_args()
+
+    selected = [(name, func) for name, func in SCENARIOS if not args.names or name in args.names]
+    baselines = load_baselines(args.baselines)
+    results = {}
+    regressions = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        ctx = make_images(directory)
+        ctx['dir'] = directory
+
+        print("%-12s %10s %10s %8s" % ("scenario", "seconds", "baseline", "ratio"))
+        for name, func in selected:
+            seconds, info = run_scenario(func, ctx, args.repeat)
+            results[name] = seconds
+            baseline = baselines.get(name)
+            ratio = seconds / baseline if baseline else None
+            if ratio and ratio > args.tolerance:
+                regressions.append(name)
+            print("%-12s %10.4f %10s %8s %s" % (name, seconds, '%.4f' % baseline if baseline else '-',
+                                                 '%.2f' % ratio if ratio else '-', info if info else ''))
+
+    if args.save_baselines:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Saved baselines to", args.baselines)
+
+    if regressions:
+        print("Slower than baseline:", ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
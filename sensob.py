@@ -1,8 +1,27 @@
+import time
 from abc import abstractmethod
+from functools import wraps
 
-from reflectance_sensors import *
-from ultrasonic import *
-from camera import *
+import devices
+from metrics import REGISTRY
+
+
+# Pakker inn update() slik at lesetiden havner i metrics-registeret
+def timed_read(update, name):
+    @wraps(update)
+    def timed_update(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return update(self, *args, **kwargs)
+        finally:
+            REGISTRY.histogram('sensob_read_seconds', sensob=name).observe(time.time() - start)
+    return timed_update
+
+
+# Kostklasser for sensobs og behaviors. Bbcon bruker dem til å anslå hvor lang tid et timestep tar.
+CHEAP = 0                                          # noen få GPIO-lesinger
+MODERATE = 1                                       # titalls millisekunder
+EXPENSIVE = 2                                      # sonar-ping, kamera
 
 
 class Sensob:                                      # interface mellom en eller flere sensorer i bbcons 'behaviors'
@@ -10,6 +29,35 @@ class Sensob:                                      # interface mellom en eller f
     def __init__(self):
         self.sensors = []
         self.value = None
+        self.device = None                        # devices.LazyDevice som lager sensoren første gang den brukes
+        self._sensor = None
+        self.cost = CHEAP                         # kostklassen til update()
+        self.critical = False                     # kritiske sensobs leses hvert timestep, også ved load shedding
+
+    # Alle sensob-klasser som har sin egen update() får den målt
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'update' in cls.__dict__:
+            cls.update = timed_read(cls.update, cls.__name__)
+
+    # Bruker sensor hvis den er gitt (f.eks. en simulert sensor), ellers den delte enheten med dette navnet
+    def use_device(self, sensor, name, factory):
+        if sensor is not None:
+            self.sensor = sensor
+        else:
+            self.device = devices.device(name, factory)
+
+    @property
+    def sensor(self):
+        if self._sensor is None and self.device is not None:
+            self.sensor = self.device.get()
+        return self._sensor
+
+    @sensor.setter
+    def sensor(self, sensor):
+        self._sensor = sensor
+        if sensor not in self.sensors:
+            self.sensors.append(sensor)
 
     def get_value(self):
         return self.value
@@ -25,10 +73,10 @@ class Sensob:                                      # interface mellom en eller f
 
 class ReflectanceSensob(Sensob):
 
-    def __init__(self):
+    def __init__(self, sensor=None):
         super(ReflectanceSensob, self).__init__()
-        self.sensor = ReflectanceSensors()
-        self.sensors.append(self.sensor)
+        self.critical = True
+        self.use_device(sensor, 'reflectance', devices.reflectance_sensors)
 
     def update(self):                             # returnerer list of values, [left, midleft, midright, right]
         self.sensor.update()
@@ -38,35 +86,271 @@ class ReflectanceSensob(Sensob):
     def get_value(self):                          # returnerer list of values, [left, midleft, midright, right]
         return self.value
 
+    # Leser sensorene og sier om linjen er under en av de to midterste. Brukes til å avslutte closed-loop svinger.
+    def line_centered(self, threshold=0.3):
+        value = self.update()
+        return min(value[2], value[3]) < threshold
+
 
 class UltrasonicSensob(Sensob):
 
-    def __init__(self):
+    def __init__(self, adaptive=False, sensor=None, clock=time.time):
         super(UltrasonicSensob, self).__init__()
-        self.sensor = Ultrasonic()
-        self.sensors.append(self.sensor)
+        self.cost = EXPENSIVE
+        self.critical = True
+        self.use_device(sensor, 'ultrasonic', devices.ultrasonic)
         # print("US-sensob created.")
+        self.adaptive = adaptive                  # pinger bare når det trengs, se ping_interval
+        self.clock = clock                        # tiden pingene planlegges etter, simuleringer gir sin egen
+        self.min_interval = 0.0                   # sekunder mellom ping når noe er nært eller nærmer seg fort
+        self.max_interval = 2.0                   # sekunder mellom ping når alt er langt unna eller vi står stille
+        self.safety_distance = 10                 # cm, samme grense som Obstruction bruker
+        self.max_speed = 50                       # cm/s ved full fart fremover
+        self.speed = 0                            # robotens fart fremover i cm/s, settes med set_speed
+        self.last_ping = 0.0                      # tidspunktet for siste ping
+        self.last_distance = 0.0                  # nærmeste av siste måling og medianen, det neste ping planlegges ut fra
+        self.pings = 0
+        self.skipped = 0
+
+        # Ringbuffer med de siste målingene og tidspunktene de ble tatt
+        self.history_size = 5
+        self.distances = [0.0] * self.history_size
+        self.times = [0.0] * self.history_size
+        self.count = 0
+
+    def update(self, force=False):              # force=True pinger selv om det ikke er tid for det ennå
+        if not self.adaptive:
+            self.sensor.update()
+            self.value = self.sensor.get_value()
+            return self.value
+
+        now = self.clock()
+        if self.count and not force and not self.ping_due(now):
+            self.skipped += 1
+            return self.value
 
-    def update(self):
         self.sensor.update()
-        self.value = self.sensor.get_value()
+        raw = self.sensor.get_value()
+        self.add_reading(raw, now)
+        median = self.median_distance()
+
+        # Medianen filtrerer bare målinger som sier at det er fritt. Sier én måling at noe er nært, stoler vi på
+        # den med en gang, og neste ping planlegges ut fra den nærmeste av de to.
+        self.value = raw if raw < self.safety_distance else median
+        self.last_ping = now
+        self.last_distance = min(raw, median)
         return self.value
 
+    # Om det er tid for å pinge igjen. Regnes ut på nytt hver gang med farten vi har nå, så en robot som
+    # akkurat har begynt å kjøre ikke venter på et intervall som ble planlagt mens den sto stille.
+    def ping_due(self, now):
+        return now >= self.last_ping + self.ping_interval(self.last_distance)
+
     def get_value(self):
         return self.value                         # returnerer value som distanse i cm
 
+    # Pinger og sier om det er fritt lenger enn distance cm foran. Kan brukes til å avslutte closed-loop svinger.
+    def path_clear(self, distance=None):
+        value = self.update(force=True)
+        return value is not None and value > (self.safety_distance if distance is None else distance)
+
+    # Farten fremover som andel av full fart, slik den står i motor-kommandoene
+    def set_speed(self, fraction):
+        self.speed = max(fraction, 0) * self.max_speed
+
+    def add_reading(self, distance, now):
+        i = self.count % self.history_size
+        self.distances[i] = distance
+        self.times[i] = now
+        self.count += 1
+        self.pings += 1
+
+    # Returnerer de siste n målingene, eldste først
+    def recent(self, n):
+        n = min(n, self.count, self.history_size)
+        idx = [(self.count - n + k) % self.history_size for k in range(n)]
+        return [self.distances[i] for i in idx], [self.times[i] for i in idx]
+
+    # Median av de tre siste målingene, fjerner enkeltstående feilmålinger som sier at det er fritt
+    def median_distance(self):
+        distances, _ = self.recent(3)
+        if len(distances) < 3:
+            return distances[-1]
+        return sorted(distances)[1]
+
+    # Hvor fort avstanden minker, i cm/s. Regnes ut fra eldste og nyeste måling i ringbufferet.
+    def closing_speed(self):
+        distances, times = self.recent(self.history_size)
+        if len(distances) < 2 or times[-1] <= times[0]:
+            return 0.0
+        return (distances[0] - distances[-1]) / (times[-1] - times[0])
+
+    # Tiden til neste ping når nærmeste hindring er distance cm unna. Vi pinger slik at hindringen ikke rekker å
+    # komme innenfor safety_distance mellom to ping, med en faktor 2 i margin.
+    def ping_interval(self, distance):
+        distance = distance - self.safety_distance
+        if distance <= 0:
+            return self.min_interval
+        speed = max(self.speed, self.closing_speed())
+        if speed <= 0:
+            return self.max_interval
+        return min(max(distance / speed / 2, self.min_interval), self.max_interval)
+
+
+class IRProximitySensob(Sensob):
+
+    def __init__(self, sensor=None):
+        super(IRProximitySensob, self).__init__()
+        self.critical = True
+        self.use_device(sensor, 'ir_proximity', devices.ir_proximity)
+
+    def update(self):                             # returnerer [venstre, hoyre], True betyr at noe er nært
+        self.value = self.sensor.update()
+        return self.value
+
+    def get_value(self):
+        return self.value
+
+    def something_near(self):
+        return bool(self.value) and any(self.value)
+
 
 class CameraSensob(Sensob):
-    def __init__(self):
+    def __init__(self, pool=None, sensor=None, change_threshold=4.0):
         super(CameraSensob, self).__init__()
-        self.sensor = Camera()
-        self.sensors.append(self.sensor)
+        self.cost = EXPENSIVE
+        self.use_device(sensor, 'camera', devices.camera())
         self.value = None
+        self.pool = pool                          # FramePool å låne bilder fra, ellers lages nye bilder
+
+        # Endringsdeteksjon: hvert bilde skaleres ned til et lite RGB-bilde og sammenlignes med bildet analysen ble
+        # gjort på. Er gjennomsnittlig forskjell (0-255) under change_threshold i alle fargebåndene, gjenbrukes
+        # analysen. Båndene sammenlignes hver for seg, så en ny farge med samme lysstyrke regnes som en endring.
+        # None slår det av.
+        self.change_threshold = change_threshold
+        self.thumbnail_size = (16, 12)
+        self.reference = None                     # thumbnail av bildet analysen gjelder for
+        self.analysis = {}                        # resultater for scenen i reference
+        self.unchanged = False                    # True hvis siste bilde viste samme scene som forrige
+        self.reused = 0
+        self.analyzed = 0
+        self.prefetched = None                    # bilde tatt av prefetch() som update() skal bruke
 
     def update(self):
-        self.sensor.update()
-        self.value = self.sensor.get_value()
+        if self.prefetched is None:
+            self.sensor.update(out=self.borrow_frame())
+            self.value = self.sensor.get_value()
+        else:
+            self.value = self.prefetched
+            self.prefetched = None
+        self.detect_change()
         return self.value
 
+    # Tar bildet som subprosess fra event-loopen i AsyncBbcon, mens sensorene leses i en annen tråd
+    async def prefetch(self):
+        await self.sensor.update_async(out=self.borrow_frame())
+        self.prefetched = self.sensor.get_value()
+
+    def borrow_frame(self):
+        if not self.pool:
+            return None
+        # Forrige bilde gis tilbake, med mindre noen har tatt det med take()
+        self.pool.give_back(self.value)
+        self.value = None
+        return self.pool.borrow()
+
+    def detect_change(self):
+        self.unchanged = False
+        if self.change_threshold is None or self.value is None:
+            self.analysis = {}
+            return
+        from PIL import ImageChops, ImageStat
+        thumbnail = self.value.convert('RGB').resize(self.thumbnail_size)
+        if self.reference is not None:
+            diff = max(ImageStat.Stat(ImageChops.difference(thumbnail, self.reference)).mean)
+            self.unchanged = diff < self.change_threshold
+        if not self.unchanged:
+            # Referansen flyttes bare når scenen har endret seg, så små endringer over flere bilder summeres opp
+            self.reference = thumbnail
+            self.analysis = {}
+
+    # Henter resultatet fra analysis hvis scenen ikke har endret seg, ellers regnes det ut og lagres
+    def analyze(self, name, compute):
+        if name in self.analysis:
+            self.reused += 1
+            REGISTRY.counter('camera_analysis_total', result='reused').inc()
+            return self.analysis[name]
+        if self.value is None:
+            return None
+        self.analyzed += 1
+        REGISTRY.counter('camera_analysis_total', result='computed').inc()
+        result = self.analysis[name] = compute()
+        return result
+
+    # Tar over eierskapet til siste bilde. Den som tar bildet må gi det tilbake til poolen selv.
+    def take(self):
+        value = self.value
+        self.value = None
+        return value
+
     def get_value(self):
         return self.value                         # returnerer value som en RGB-array
+
+    def get_color_sums(self):                     # returnerer summen av R, G og B i siste bilde
+        from imager2 import Imager
+        return self.analyze('color_sums', lambda: Imager(image=self.value).color_sums())
+
+    def get_dominant_color(self):                 # 'red', 'green', 'blue' eller None, fra et utvalg av pikslene
+        from imager2 import Imager
+        return self.analyze('dominant_color', lambda: Imager(image=self.value).classify_color()[0])
+
+
+class CameraLineSensob(Sensob):
+
+    # Finner linjen foran roboten i et lavopplost kamerabilde. Noen rader nederst i bildet terskles, og for hver
+    # rad regnes midtpunktet til de morke pikslene ut. value er [offset, kurvatur]:
+    #   offset   - hvor linjen er i den nærmeste raden, fra -1 (helt til venstre) til 1 (helt til hoyre)
+    #   kurvatur - hvor mye lenger til siden linjen er i den fjerneste raden enn i den nærmeste
+    # value er None hvis linjen ikke ble funnet i noen rad.
+
+    def __init__(self, img_width=64, img_height=48, rows=(0.95, 0.8, 0.65, 0.5), threshold=80, sensor=None):
+        super(CameraLineSensob, self).__init__()
+        self.cost = EXPENSIVE
+        self.use_device(sensor, 'camera_%dx%d' % (img_width, img_height), devices.camera(img_width, img_height))
+        self.rows = rows                            # radene som skannes, som andel av bildehoyden (1 er nederst)
+        self.threshold = threshold                  # gråverdier under dette regnes som linje
+        self.min_pixels = 2                         # minste antall morke piksler for at en rad teller
+        self.row_offsets = None                     # offset for hver rad, nan der linjen ikke ble sett
+        self.prefetched = None                      # bilde tatt av prefetch() som update() skal bruke
+
+    def update(self):
+        import numpy as np
+        image = self.prefetched if self.prefetched is not None else self.sensor.update()
+        self.prefetched = None
+        self.value = self.find_line(np.asarray(image.convert('L')))
+        return self.value
+
+    async def prefetch(self):
+        self.prefetched = await self.sensor.update_async()
+
+    def get_value(self):
+        return self.value
+
+    def find_line(self, gray):
+        import numpy as np
+        height, width = gray.shape
+        row_index = np.clip((np.asarray(self.rows) * height).astype(int), 0, height - 1)
+        mask = gray[row_index] < self.threshold
+        counts = mask.sum(axis=1)
+        xs = np.linspace(-1, 1, width)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offsets = (mask * xs).sum(axis=1) / counts
+        offsets[counts < self.min_pixels] = np.nan
+        self.row_offsets = offsets
+
+        seen = np.flatnonzero(~np.isnan(offsets))
+        if len(seen) == 0:
+            return None
+        nearest = offsets[seen[0]]
+        farthest = offsets[seen[-1]]
+        return [float(nearest), float(farthest - nearest)]
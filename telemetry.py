@@ -0,0 +1,205 @@
+import math
+import os
+import socket
+import struct
+import sys
+
+# Sender en fast binær post per timestep til alle som er koblet til, over TCP eller en Unix-socket.
+# Roboten lytter, og viewer-klienten nederst i filen kobler seg til når den vil. Som standard lyttes det bare
+# lokalt; PUBLIC_ADDRESS gjør telemetrien synlig på alle nettverkskort, og må velges eksplisitt.
+#
+# Hver melding starter med en byte som sier hva slags melding det er:
+#   b'N' + lengde (H) + behavior-navnene, utf-8 og skilt med komma. Sendes når en klient kobler til.
+#   b'T' + RECORD. Sendes hvert timestep.
+
+RECORD = struct.Struct('<Id6ffBHb2sfff')
+# timestep, tid, 6 reflektansverdier, sonar cm, IR-bits, aktive behaviors (bitmaske over bbcon.behaviors),
+# vinner (indeks, -1 = ingen), motorkommando, to kommando-argumenter, tiden timestepet tok
+NAN = float('nan')
+LOCAL_ADDRESS = ('127.0.0.1', 5555)
+PUBLIC_ADDRESS = ('0.0.0.0', 5555)
+
+
+class TelemetryPublisher:
+
+    # address er (host, port) for TCP eller en sti for en Unix-socket. Alt er ikke-blokkerende: henger en klient
+    # etter, kastes postene til den har lest det den allerede har fått.
+
+    def __init__(self, address=LOCAL_ADDRESS):
+        self.address = address
+        self.server = None
+        self.clients = {}                       # socket -> bytes som ikke er sendt ennå
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen(4)
+        self.server.setblocking(False)
+
+    def stop(self):
+        for client in list(self.clients):
+            client.close()
+        self.clients = {}
+        if self.server:
+            self.server.close()
+            self.server = None
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def accept(self, names):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client.setblocking(False)
+            if not isinstance(self.address, str):
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            data = ','.join(names).encode()
+            self.clients[client] = b'N' + struct.pack('<H', len(data)) + data
+            if not self.flush(client):
+                self.drop_client(client)
+
+    # Sender det som ligger i køen til klienten. Returnerer False hvis klienten er borte.
+    def flush(self, client):
+        pending = self.clients[client]
+        try:
+            n = client.send(pending)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        self.clients[client] = pending[n:]
+        return True
+
+    def send(self, message, names):
+        self.accept(names)
+        for client in list(self.clients):
+            if self.clients[client]:
+                # Klienten har ikke fått forrige melding ennå, så denne kastes
+                self.dropped += 1
+                if not self.flush(client):
+                    self.drop_client(client)
+                continue
+            self.clients[client] = message
+            if not self.flush(client):
+                self.drop_client(client)
+            else:
+                self.sent += 1
+
+    def drop_client(self, client):
+        client.close()
+        del self.clients[client]
+
+    # Henter ut det som skal sendes fra bbcon og sender det
+    def publish(self, bbcon, duration):
+        if not self.server:
+            return
+        names = [behavior.name for behavior in bbcon.behaviors]
+        self.send(b'T' + self.pack(bbcon, duration), names)
+
+    def pack(self, bbcon, duration):
+        reflectance = [NAN] * 6
+        sonar = NAN
+        ir = 0
+        for behavior in bbcon.behaviors:
+            for sensob in behavior.sensobs:
+                value = sensob.get_value()
+                if value is None:
+                    continue
+                kind = type(sensob).__name__
+                if kind == 'ReflectanceSensob':
+                    reflectance = (list(value) + [NAN] * 6)[:6]
+                elif kind == 'UltrasonicSensob':
+                    sonar = value
+                elif kind == 'IRProximitySensob':
+                    ir = int(bool(value[0])) | int(bool(value[1])) << 1
+
+        active = 0
+        for behavior in bbcon.active_behaviors:
+            active |= 1 << bbcon.behaviors.index(behavior)
+        names = [behavior.name for behavior in bbcon.behaviors]
+        winner = names.index(bbcon.arbitrator.winner) if bbcon.arbitrator.winner in names else -1
+
+        values = list(bbcon.motobs.values) + [NAN, NAN]
+        command = str(values[0]).encode()[:2]
+        args = [float(v) if isinstance(v, (int, float)) else NAN for v in values[1:3]]
+
+        return RECORD.pack(bbcon.num_timesteps, bbcon.timestep_start, *reflectance, sonar, ir, active & 0xffff,
+                           winner, command, args[0], args[1], duration)
+
+
+# Leser meldinger fra socketen og gir hver post videre som en dict til callback
+def read_stream(sock, callback):
+    names = []
+    buf = b''
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buf += data
+        while buf:
+            if buf[:1] == b'N':
+                if len(buf) < 3:
+                    break
+                n = struct.unpack_from('<H', buf, 1)[0]
+                if len(buf) < 3 + n:
+                    break
+                names = buf[3:3 + n].decode().split(',')
+                buf = buf[3 + n:]
+            elif buf[:1] == b'T':
+                if len(buf) < 1 + RECORD.size:
+                    break
+                callback(decode(RECORD.unpack_from(buf, 1), names))
+                buf = buf[1 + RECORD.size:]
+            else:
+                raise ValueError("Unknown telemetry message %r" % buf[:1])
+
+
+def decode(fields, names):
+    timestep, timestamp = fields[0], fields[1]
+    reflectance = fields[2:8]
+    sonar, ir, active, winner, command, arg1, arg2, duration = fields[8:]
+    return {'timestep': timestep, 'time': timestamp, 'reflectance': list(reflectance),
+            'sonar': None if math.isnan(sonar) else sonar, 'ir': [bool(ir & 1), bool(ir & 2)],
+            'active': [name for i, name in enumerate(names) if active & (1 << i)],
+            'winner': names[winner] if 0 <= winner < len(names) else None,
+            'command': command.rstrip(b'\0').decode(),
+            'args': [a for a in (arg1, arg2) if not math.isnan(a)], 'duration': duration}
+
+
+def print_record(record):
+    print("%6d %6.3fs %-20s %-4s %-12s sonar=%-6s refl=%s active=%s" % (
+        record['timestep'], record['duration'], record['winner'], record['command'],
+        ','.join('%.2f' % a for a in record['args']),
+        'none' if record['sonar'] is None else '%.1f' % record['sonar'],
+        ' '.join('%.2f' % r for r in record['reflectance']), ','.join(record['active'])))
+
+
+# Enkel viewer: python telemetry.py [host:port | /sti/til/socket]
+def main():
+    target = sys.argv[1] if len(sys.argv) > 1 else 'localhost:5555'
+    if ':' in target:
+        host, port = target.rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target)
+    try:
+        read_stream(sock, print_record)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import RPi.GPIO as GPIO
 import time
+from metrics import REGISTRY
 
 class Ultrasonic():
 
@@ -43,6 +44,9 @@ class Ultrasonic():
             read_val = GPIO.input(self.echo_pin)
             signaloff = time.time()
 
+        if read_val == 0:
+            REGISTRY.counter('sonar_timeouts_total').inc()
+
         signalon = signaloff
         # Finner saa den tiden det siste signalet kommer inn paa echo_pin
         while read_val == 1: